@@ -2,10 +2,15 @@ import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
+from config import RESOLUTIONS
+from figure_cache import cached_figure
+from frequencies import frequencies_window, tweet_frequencies
 
-def build_graph(frequencies_df, clusters):
+
+def build_graph(frequencies_df, clusters, start=None, end=None,
+                resolution='D'):
     """
-    Build the graph
+    Build the graph, the x-axis shows the dates start to end
 
     Return fig
     """
@@ -15,10 +20,11 @@ def build_graph(frequencies_df, clusters):
 
     # Add traces
     if clusters:
-        for c in clusters:
+        # Clusters of another language have no column
+        for c in [c for c in clusters if c in frequencies_df]:
             fig.add_trace(
                 go.Scatter(
-                    x=frequencies_df['date'],
+                    x=frequencies_df['date'].values,
                     y=frequencies_df[c],
                     name=f"Tweets {c}"
                 ),
@@ -27,7 +33,7 @@ def build_graph(frequencies_df, clusters):
 
     fig.add_trace(
             go.Scatter(
-                x=frequencies_df['date'],
+                x=frequencies_df['date'].values,
                 y=frequencies_df['sum'],
                 name="Tweets sum"
             ),
@@ -36,7 +42,7 @@ def build_graph(frequencies_df, clusters):
 
     fig.add_trace(
         go.Scatter(
-            x=frequencies_df['date'],
+            x=frequencies_df['date'].values,
             y=frequencies_df['conflicts'],
             name="Conflicts Ukrain"
         ),
@@ -46,7 +52,7 @@ def build_graph(frequencies_df, clusters):
     # Add styling to analysis graph visualisation
     fig.update_layout(
         height=800,
-        title_text="Frequency conflicts vs tweets",
+        title_text=f"{RESOLUTIONS[resolution]} frequency conflicts vs tweets",
         font_family="Helvetica Neue",
         colorway=['#5E0DAC', '#FF4F00', '#375CB1',
                   '#FF7400', '#FFF400', '#FF0056'],
@@ -57,10 +63,12 @@ def build_graph(frequencies_df, clusters):
                 showgrid=True,
                 gridcolor='lightpink',
                 # gridwidth=0.5,
+                # The windows of the data include the whole end day
                 range=[
-                    pd.to_datetime("01-01-2016"),
-                    pd.to_datetime("31-12-2016")
-                ],
+                    pd.to_datetime(start) if start else None,
+                    pd.to_datetime(end) + pd.Timedelta(days=1)
+                    if end else None
+                ] if start or end else None,
                 rangeslider_visible=True,
                 type="date"
         ),
@@ -80,9 +88,14 @@ def build_graph(frequencies_df, clusters):
     return fig
 
 
-def run_analyses_graph(clusters):
+@cached_figure
+def run_analyses_graph(language, clusters, start=None, end=None,
+                       resolution='D'):
+
+    # Frequencies of the network of the language, within [start, end]
+    frequencies_df = tweet_frequencies(language, resolution)
+    frequencies_df = frequencies_window(frequencies_df, start, end)
 
-    frequencies_df = pd.read_csv('new_graphs/tweet-conflict_frequencies.csv')
-    fig = build_graph(frequencies_df, clusters)
+    fig = build_graph(frequencies_df, clusters, start, end, resolution)
 
     return fig
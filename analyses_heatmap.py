@@ -0,0 +1,113 @@
+import numpy as np
+import plotly.graph_objects as go
+
+from config import RESOLUTIONS
+from figure_cache import cached_figure
+from frequencies import frequencies_window, tweet_frequencies
+
+
+def window_sums(values, window):
+    """
+    Sums of every run of window rows, from the difference of two
+    cumulative sums instead of summing each window
+
+    Return: np.ndarray (rows - window + 1, ...)
+    """
+
+    cumsum = np.cumsum(values, axis=0)
+    cumsum = np.concatenate([np.zeros_like(cumsum[:1]), cumsum])
+
+    return cumsum[window:] - cumsum[:-window]
+
+
+def rolling_correlations(tweets, conflicts, window):
+    """
+    Pearson r between every column of tweets (rows x clusters) and the
+    conflicts (rows) over every run of window rows. Windows in which a
+    series is constant get NaN.
+
+    Return: np.ndarray (clusters, rows - window + 1)
+    """
+
+    tweets = tweets.astype(np.float64)
+    conflicts = conflicts.astype(np.float64)[:, None]
+
+    sum_t = window_sums(tweets, window)
+    sum_c = window_sums(conflicts, window)
+    cov = window * window_sums(tweets * conflicts, window) - sum_t * sum_c
+    var_t = window * window_sums(tweets ** 2, window) - sum_t ** 2
+    var_c = window * window_sums(conflicts ** 2, window) - sum_c ** 2
+
+    # The counts are integers so the sums are exact, a constant series
+    # has a variance of exactly 0
+    denominator = np.sqrt(np.clip(var_t * var_c, 0, None))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = cov / np.where(denominator > 0, denominator, np.nan)
+
+    return r.T
+
+
+def build_heatmap(frequencies_df, window, resolution='D'):
+    """
+    Heatmap of the rolling correlation of every cluster and the sum,
+    each column is the window ending at that date
+
+    Return: fig
+    """
+
+    columns = [
+        c for c in frequencies_df.columns if c not in ('date', 'conflicts')
+    ]
+
+    fig = go.Figure()
+    if len(frequencies_df) >= window:
+        r = rolling_correlations(
+            frequencies_df[columns].values,
+            frequencies_df['conflicts'].values,
+            window
+        )
+        fig.add_trace(
+            go.Heatmap(
+                x=frequencies_df['date'].values[window - 1:],
+                y=columns,
+                # Three decimals are plenty for a colour. An object array
+                # is sent as a list, smaller than a typed array of r
+                z=np.round(r, 3).astype(object),
+                zmin=-1,
+                zmax=1,
+                zmid=0,
+                colorscale='RdBu_r',
+                colorbar=dict(title='Pearson R'),
+                hoverongaps=False,
+                hovertemplate='%{y}<br>%{x}<br>r = %{z:.3f}<extra></extra>',
+            )
+        )
+
+    fig.update_layout(
+        height=800,
+        title_text=(
+            f"Rolling correlation tweets vs conflicts, "
+            f"{window} {RESOLUTIONS[resolution].lower()} periods"
+        ),
+        font_family="Helvetica Neue",
+        template='plotly_dark',
+        paper_bgcolor='rgba(0, 0, 0, 0)',
+        plot_bgcolor='rgba(0, 0, 0, 0)',
+        xaxis=dict(type='date'),
+        yaxis=dict(type='category', autorange='reversed'),
+    )
+
+    return fig
+
+
+@cached_figure
+def run_analyses_heatmap(language, start=None, end=None, resolution='D',
+                         window=30):
+
+    # The same frequencies as the analysis graph
+    frequencies_df = tweet_frequencies(language, resolution)
+    frequencies_df = frequencies_window(frequencies_df, start, end)
+
+    fig = build_heatmap(frequencies_df, window, resolution)
+
+    return fig
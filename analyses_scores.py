@@ -1,22 +1,86 @@
-import pickle
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
+from figure_cache import cached_figure
+from frequencies import frequencies_window, tweet_frequencies
 
-def select_r_scores(r_scores, clusters):
 
-    selected = []
-    for c in r_scores:
-        if c['Cluster'] in clusters or c['Cluster'] == 'sum':
-            selected.append(c)
+def standardize(values, axis):
+    """
+    Values minus their mean, divided by their standard deviation along
+    axis. Constant series become NaN.
 
-    return selected
+    Return: np.ndarray
+    """
+
+    values = values - values.mean(axis=axis, keepdims=True)
+    std = values.std(axis=axis, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return values / np.where(std > 0, std, np.nan)
+
+
+def lagged_correlations(tweets, conflicts, max_lag):
+    """
+    Pearson r between every column of tweets (days x clusters) and the
+    conflicts (days), for the lags -max_lag..max_lag in days. At lag l
+    the tweets of day t are compared with the conflicts of day t - l, a
+    positive lag means the tweets follow the conflicts.
+
+    Every lag uses the same days, the tweets without the first and last
+    max_lag days, so all r are computed in a single matrix product.
+
+    Return: np.ndarray (2 * max_lag + 1, clusters), row i is lag i - max_lag
+    """
+
+    days = len(conflicts) - 2 * max_lag
+    if days < 3:
+        return np.full((2 * max_lag + 1, tweets.shape[1]), np.nan)
+
+    # Row j holds the conflicts shifted by lag max_lag - j
+    shifted = sliding_window_view(conflicts.astype(np.float64), days)[::-1]
+    tweets = tweets[max_lag:max_lag + days].astype(np.float64)
 
+    return standardize(shifted, axis=1) @ standardize(tweets, axis=0) / days
 
-def run_analyses_scores(clusters):
+
+def best_lags(frequencies_df, clusters, max_lag):
+    """
+    Lag with the strongest correlation (highest |r|) between the tweets
+    of every cluster, and their sum, and the conflicts
+
+    Return: list(dict)
+    """
+
+    columns = [c for c in clusters if c in frequencies_df] + ['sum']
+    r = lagged_correlations(
+        frequencies_df[columns].values,
+        frequencies_df['conflicts'].values,
+        max_lag
+    )
+
+    scores = []
+    for i, c in enumerate(columns):
+        if np.isnan(r[:, i]).all():
+            scores.append({'Cluster': c, 'Lag': None, 'Pearson R': None})
+            continue
+        best = np.nanargmax(np.abs(r[:, i]))
+        scores.append({
+            'Cluster': c,
+            'Lag': int(best) - max_lag,
+            'Pearson R': round(float(r[best, i]), 3),
+        })
+
+    return scores
+
+
+@cached_figure
+def run_analyses_scores(language, clusters, start=None, end=None,
+                        max_lag=0):
     selected = None
     if clusters:
-        with open('new_graphs/pearson_r.pickle', 'rb') as f:
-            r_scores = pickle.load(f)
-
-        selected = select_r_scores(r_scores, clusters)
+        frequencies_df = frequencies_window(
+            tweet_frequencies(language), start, end
+        )
+        selected = best_lags(frequencies_df, clusters, max_lag)
 
     return selected
@@ -1,22 +1,80 @@
+# First, so the startup phases time every other import
+from startup import lazy, mark, phase, preload, report, report_first_response
+
+import functools
+import itertools
+import logging
+
 import dash
 import dash_table
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
+
+import config
+import metrics
+from figures import build_figures, call
+
+# Nothing else configures logging, the logs of the dashboard would be
+# dropped below WARNING
+logging.basicConfig(format='%(asctime)s %(name)s %(levelname)s %(message)s')
+for name in ('startup', 'figures'):
+    logging.getLogger(name).setLevel(config.LOG_LEVEL)
+
+mark('import dash')
 
-from retweet_graph import run_retweet_graph
-from retweet_geograph import run_retweet_geograph
-from analyses_graph import run_analyses_graph
-from analyses_scores import run_analyses_scores
-from similarity_graph import run_similarity_graph
-from doc_explain import run_doc_explain
+# The figure modules import pandas, networkx and their data, they are
+# imported on the first call instead of with the app
+run_retweet_graph = lazy('retweet_graph', 'run_retweet_graph')
+run_retweet_patch = lazy('retweet_graph', 'run_retweet_patch')
+run_retweet_detail = lazy('retweet_graph', 'run_retweet_detail')
+retweet_window_sampled = lazy('retweet_graph', 'window_sampled')
+retweet_arrays = lazy('retweet_graph', 'retweet_arrays')
+run_retweet_geograph = lazy('retweet_geograph', 'run_retweet_geograph')
+run_retweet_geopatch = lazy('retweet_geograph', 'run_retweet_geopatch')
+run_analyses_graph = lazy('analyses_graph', 'run_analyses_graph')
+run_analyses_heatmap = lazy('analyses_heatmap', 'run_analyses_heatmap')
+run_analyses_scores = lazy('analyses_scores', 'run_analyses_scores')
+run_similarity_graph = lazy('similarity_graph', 'run_similarity_graph')
+run_doc_explain = lazy('doc_explain', 'run_doc_explain')
+
+FIGURE_MODULES = sorted({
+    function.module for function in [
+        run_retweet_graph, run_retweet_geograph, run_analyses_graph,
+        run_analyses_heatmap, run_analyses_scores, run_similarity_graph,
+        run_doc_explain
+    ]
+})
 
 # external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 
-app = dash.Dash(__name__)
+app = dash.Dash(__name__, compress=config.COMPRESS)
 # , external_stylesheets=external_stylesheets)
 
-app.layout = html.Div(children=[html.Div(
+# Graph on every tab, in the order of the outputs of update_graph_values
+TAB_GRAPHS = {
+    'tab-1': 'histogram',
+    'tab-2': 'analysis-graph',
+    'tab-3': 'similarity-graph',
+    'tab-4': 'geo-graph',
+    'tab-5': 'rolling-graph',
+}
+if config.CLIENTSIDE_FILTERING:
+    # The histogram is built in the browser, see assets/clientside.js
+    del TAB_GRAPHS['tab-1']
+
+# State of the browser, next to the layout
+STORES = [
+    # Inputs of the figure last sent to every tab, see update_graph_values
+    dcc.Store(id='rendered-figures', data={}),
+    # Band and color slot of every cluster in the figures of the tabs
+    dcc.Store(id='cluster-slots', data={}),
+    # Retweet network of the language, with CLIENTSIDE_FILTERING
+    dcc.Store(id='retweet-arrays'),
+]
+
+app.layout = html.Div(children=STORES + [html.Div(
     className='row',
     children=[
         html.Div(
@@ -44,6 +102,33 @@ app.layout = html.Div(children=[html.Div(
                         ),
                     ],
                 ),
+                # Date window of every tab
+                html.Div(
+                    className='div-user-controls div-for-dropdown',
+                    children=[
+                        dcc.DatePickerRange(
+                            id='date-range',
+                            start_date=config.DEFAULT_START_DATE,
+                            end_date=config.DEFAULT_END_DATE,
+                            display_format='DD-MM-YYYY',
+                        ),
+                    ],
+                ),
+                # Resolution of the frequencies in the analysis graph
+                html.Div(
+                    className='div-user-controls div-for-dropdown',
+                    children=[
+                        dcc.RadioItems(
+                            id='resolution',
+                            options=[
+                                {'label': label, 'value': value}
+                                for value, label in config.RESOLUTIONS.items()
+                            ],
+                            value='D',
+                            labelStyle={'display': 'inline-block'},
+                        ),
+                    ],
+                ),
                 # Cluster selector
                 html.Div(
                     className='div-user-controls div-for-checklist',
@@ -107,6 +192,29 @@ app.layout = html.Div(children=[html.Div(
                                     children=[
                                         dcc.Graph(id='geo-graph'),
                                     ],
+                                ),
+                                dcc.Tab(
+                                    label='Rolling Correlation',
+                                    value='tab-5',
+                                    id='rolling_tab',
+                                    className='custom-tab',
+                                    selected_className='custom-tab--selected',
+                                    children=[
+                                        # Periods in a window, at the
+                                        # selected resolution
+                                        dcc.Slider(
+                                            id='rolling-window',
+                                            min=5,
+                                            max=90,
+                                            step=1,
+                                            value=30,
+                                            marks={
+                                                w: str(w)
+                                                for w in (5, 30, 60, 90)
+                                            },
+                                        ),
+                                        dcc.Graph(id='rolling-graph'),
+                                    ],
                                 )
                             ],
                             colors={
@@ -158,11 +266,20 @@ app.layout = html.Div(children=[html.Div(
             className="two columns",
             children=[
                 html.H3("Results"),
+                # Days the tweets may lead or follow the conflicts
+                dcc.Slider(
+                    id='max-lag',
+                    min=0,
+                    max=30,
+                    step=1,
+                    value=config.DEFAULT_MAX_LAG,
+                    marks={lag: str(lag) for lag in (0, 7, 14, 30)},
+                ),
                 dash_table.DataTable(
                     id='pearson_r_table',
                     # className='table',
                     columns=[
-                        {"name": i, "id": i} for i in ['Cluster', 'Pearson R']
+                        {"name": i, "id": i} for i in ['Cluster', 'Lag', 'Pearson R']
                     ],
                     style_header={'backgroundColor': 'rgb(30, 30, 30)'},
                     style_cell={
@@ -182,49 +299,281 @@ app.layout = html.Div(children=[html.Div(
     ]
 )])
 
+mark('layout')
+
 
 @app.callback(
     # Set initial cluster-selector options
     Output('cluster-selector', 'options'),
     # Set initial cluster-selector values
     Output('cluster-selector', 'value'),
-    # Updates from run_retweet
-    Output('similarity-graph', 'figure'),
 
     # Gives value to run_retweet
     Input('language-selector', 'value'),
 )
 def update_graph_initial(language):
-    cluster_options = run_retweet_graph(language, cluster_update=True)
+    cluster_options = call(run_retweet_graph, language, cluster_update=True)
     cluster_values = [c['label'] for c in cluster_options][:3]
-    similarities = run_similarity_graph()
 
-    return cluster_options, cluster_values, similarities
+    return cluster_options, cluster_values
 
 
-@app.callback(
-    # Updates from run_retweet
-    Output('histogram', 'figure'),
-    # Update geo graph
-    Output('geo-graph', 'figure'),
-    # Updates from run_analyses
-    Output('analysis-graph', 'figure'),
-    # Updates pearson r scores
-    Output('pearson_r_table', 'data'),
+def tab_inputs(tab, controls):
+    """
+    The values of the controls the figure of a tab depends on
+
+    Return: list()
+    """
+
+    window = [controls['start'], controls['end']]
+    if tab in ('tab-1', 'tab-4'):
+        return [controls['language'], controls['clusters']] + window
+    if tab == 'tab-2':
+        return [controls['language'], controls['clusters']] + window + [
+            controls['resolution']
+        ]
+    if tab == 'tab-5':
+        return [controls['language']] + window + [
+            controls['resolution'], controls['rolling']
+        ]
+    return window
+
+
+def tab_job(tab, controls, previous=None, slots=None):
+    """
+    The function building the figure of a tab, and its arguments. The
+    histogram and the geo graph get the slots of their clusters, and
+    are patched when only the clusters changed since the inputs previous.
+
+    Return: function, tuple()
+    """
 
+    language, clusters = controls['language'], controls['clusters']
+    start, end = controls['start'], controls['end']
+    if tab in ('tab-1', 'tab-4'):
+        patch = run_retweet_patch if tab == 'tab-1' else run_retweet_geopatch
+        full = run_retweet_graph if tab == 'tab-1' else run_retweet_geograph
+        if (previous and previous[0] == language
+                and previous[2:] == [start, end]):
+            return patch, (language, previous[1], clusters, start, end, slots)
+        # The default slots share the cached figure
+        if slots == cluster_slots({}, clusters):
+            return full, (language, clusters, start, end)
+        return functools.partial(full, slots=slots), (
+            language, clusters, start, end
+        )
+    if tab == 'tab-2':
+        return run_analyses_graph, (
+            language, clusters, start, end, controls['resolution']
+        )
+    if tab == 'tab-3':
+        return run_similarity_graph, (start, end)
+    if tab == 'tab-5':
+        return run_analyses_heatmap, (
+            language, start, end, controls['resolution'], controls['rolling']
+        )
 
+
+def cluster_slots(previous, clusters):
+    """
+    Slot (band and color) of every cluster of a figure: the clusters of
+    previous keep theirs, new clusters take the free slots in order, so
+    toggling a cluster moves no other
+
+    Return: dict(str -> int)
+    """
+
+    clusters = sorted(set(clusters or []))
+    slots = {c: s for c, s in (previous or {}).items() if c in clusters}
+    free = (s for s in itertools.count() if s not in slots.values())
+    for c in clusters:
+        if c not in slots:
+            slots[c] = next(free)
+
+    return slots
+
+
+def visible_window(relayout, start, end):
+    """
+    The days of the window [start, end] visible after a zoom of the
+    x-axis (relayoutData of a graph), (None, None) when zoomed out, and
+    None when the x-axis did not change
+
+    Return: tuple(str, str) or None
+    """
+
+    relayout = relayout or {}
+    if relayout.get('xaxis.autorange'):
+        return None, None
+    if 'xaxis.range' in relayout:
+        low, high = relayout['xaxis.range']
+    elif 'xaxis.range[0]' in relayout and 'xaxis.range[1]' in relayout:
+        low, high = relayout['xaxis.range[0]'], relayout['xaxis.range[1]']
+    else:
+        return None
+
+    # Whole days, dates of the date picker compare as strings
+    low, high = str(low)[:10], str(high)[:10]
+    if start:
+        low = max(low, start[:10])
+    if end:
+        high = min(high, end[:10])
+    if low > high or (low, high) == (start, end):
+        return None, None
+
+    return low, high
+
+
+@app.callback(
+    # One figure per tab, only the visible one is built
+    *[Output(graph, 'figure') for graph in TAB_GRAPHS.values()],
+    Output('rendered-figures', 'data'),
+    Output('cluster-slots', 'data'),
+
+    # The visible tab
+    Input('tabs-with-classes', 'value'),
     # Gives value to run_retweet
     Input('language-selector', 'value'),
     # Updates the selected clusters
-    Input('cluster-selector', 'value')
+    Input('cluster-selector', 'value'),
+    # Date window
+    Input('date-range', 'start_date'),
+    Input('date-range', 'end_date'),
+    # Resolution of the analysis graph
+    Input('resolution', 'value'),
+    # Window of the rolling correlation
+    Input('rolling-window', 'value'),
+    State('rendered-figures', 'data'),
+    State('cluster-slots', 'data'),
+)
+def update_graph_values(tab, language, clusters, start, end, resolution,
+                        rolling, rendered, slots):
+    # Wait for update_graph_initial to select the clusters
+    if clusters is None or tab not in TAB_GRAPHS:
+        raise PreventUpdate
+
+    controls = {
+        'language': language,
+        'clusters': clusters,
+        'start': start,
+        'end': end,
+        'resolution': resolution,
+        'rolling': rolling,
+    }
+
+    # The browser still has the figure when the inputs did not change,
+    # switching back to a tab costs nothing
+    rendered = rendered or {}
+    tabs = list(TAB_GRAPHS) if config.PREFETCH_TABS else [tab]
+    stale = {}
+    for t in tabs:
+        inputs = tab_inputs(t, controls)
+        if rendered.get(t) != inputs:
+            stale[t] = inputs
+    if not stale:
+        raise PreventUpdate
+
+    # Clusters keep their slot in a figure, a change of the clusters only
+    # is sent as a patch
+    slots = dict(slots or {})
+    jobs = {}
+    for t in stale:
+        if t in ('tab-1', 'tab-4'):
+            slots[t] = cluster_slots(slots.get(t), clusters)
+            jobs[t] = tab_job(t, controls, rendered.get(t), slots[t])
+        else:
+            jobs[t] = tab_job(t, controls)
+
+    # Independent figures are built concurrently, their timings are in
+    # the metrics
+    figures, _ = build_figures(jobs)
+
+    return (
+        *[figures.get(t, dash.no_update) for t in TAB_GRAPHS],
+        {**rendered, **stale},
+        slots
+    )
+
+
+if config.CLIENTSIDE_FILTERING:
+    @app.callback(
+        # Arrays for the clientside histogram, sent once per language
+        # and date window
+        Output('retweet-arrays', 'data'),
+
+        Input('language-selector', 'value'),
+        Input('date-range', 'start_date'),
+        Input('date-range', 'end_date'),
+    )
+    def update_retweet_arrays(language, start, end):
+        return call(retweet_arrays, language, start, end)
+
+    # Cluster toggles filter the arrays in the browser, no round trip
+    app.clientside_callback(
+        ClientsideFunction(
+            namespace='retweet', function_name='build_histogram'
+        ),
+        Output('histogram', 'figure'),
+
+        Input('retweet-arrays', 'data'),
+        Input('cluster-selector', 'value'),
+    )
+else:
+    @app.callback(
+        # Level of detail: the visible part of the histogram is rebuilt
+        # on zoom, sampled less (or not at all) than the whole window
+        Output('histogram', 'figure', allow_duplicate=True),
+
+        # Zoom and range slider of the histogram
+        Input('histogram', 'relayoutData'),
+        State('language-selector', 'value'),
+        State('cluster-selector', 'value'),
+        State('date-range', 'start_date'),
+        State('date-range', 'end_date'),
+        State('cluster-slots', 'data'),
+        prevent_initial_call=True,
+    )
+    def update_histogram_detail(relayout, language, clusters, start, end,
+                                slots):
+        view = visible_window(relayout, start, end)
+        if view is None or clusters is None:
+            raise PreventUpdate
+        # The figure of the window already has all of its points
+        if not call(retweet_window_sampled, language, clusters, start, end):
+            raise PreventUpdate
+
+        # The slots of the figure shown, patches rely on them
+        slots = (slots or {}).get('tab-1')
+        if slots == cluster_slots({}, clusters):
+            slots = None
+        if view == (None, None):
+            return call(
+                run_retweet_graph, language, clusters, start, end,
+                slots=slots
+            )
+        return call(
+            run_retweet_detail, language, clusters, start, end, *view,
+            slots=slots
+        )
+
+
+@app.callback(
+    # Updates pearson r scores, visible next to every tab
+    Output('pearson_r_table', 'data'),
+
+    Input('language-selector', 'value'),
+    # Updates the selected clusters
+    Input('cluster-selector', 'value'),
+    Input('date-range', 'start_date'),
+    Input('date-range', 'end_date'),
+    Input('max-lag', 'value'),
 )
-def update_graph_values(language, clusters):
-    run_retweet = run_retweet_graph(language, clusters)
-    run_geo = run_retweet_geograph(language, clusters)
-    run_analyses = run_analyses_graph(clusters)
-    r_scores = run_analyses_scores(clusters)
+def update_scores(language, clusters, start, end, max_lag):
+    r_scores = call(
+        run_analyses_scores, language, clusters, start, end, max_lag
+    )
 
-    return run_retweet, run_geo, run_analyses, r_scores
+    return r_scores
 
 
 @app.callback(
@@ -235,7 +584,7 @@ def update_graph_values(language, clusters):
     Input('language-selector', 'value'),
 )
 def update_data_table(language):
-    data_table = run_doc_explain()
+    data_table = call(run_doc_explain)
     tooltip = [{
         column: {'value': str(value), 'type': 'markdown'}
         for column, value in row.items()
@@ -244,5 +593,16 @@ def update_data_table(language):
     return data_table, tooltip
 
 
+mark('callbacks')
+
+if config.PRELOAD:
+    # Before the workers fork (gunicorn --preload) they share the data
+    with phase('preload'):
+        preload(FIGURE_MODULES, [lazy('data', 'preload')])
+
+report()
+report_first_response(app.server)
+metrics.instrument(app.server)
+
 if __name__ == '__main__':
     app.run_server(debug=True, port=8050)
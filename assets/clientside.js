@@ -0,0 +1,159 @@
+/* Clientside callbacks, used when CLIENTSIDE_FILTERING is set (config.py).
+
+The arrays of retweet_graph.retweet_arrays are sent once per language,
+toggling a cluster then builds the histogram in the browser like
+run_retweet_graph does on the server. */
+
+// Typed arrays of encoding.py, by their dtype
+const TYPED_ARRAYS = {
+    i1: Int8Array, u1: Uint8Array, i2: Int16Array, u2: Uint16Array,
+    i4: Int32Array, u4: Uint32Array, f4: Float32Array, f8: Float64Array
+};
+
+// Decoded arrays of every store, decoded once per store
+const decoded = new WeakMap();
+
+function decode(values) {
+    if (!values || values.bdata === undefined) {
+        return values;
+    }
+    const binary = atob(values.bdata);
+    const bytes = new Uint8Array(binary.length);
+    for (let i = 0; i < binary.length; i++) {
+        bytes[i] = binary.charCodeAt(i);
+    }
+    return new TYPED_ARRAYS[values.dtype](bytes.buffer);
+}
+
+function decodeStore(store) {
+    if (!decoded.has(store)) {
+        decoded.set(store, {
+            date: decode(store.date),
+            jitter: decode(store.jitter),
+            src: decode(store.src),
+            dst: decode(store.dst)
+        });
+    }
+    return decoded.get(store);
+}
+
+// Slots of the clusters of the last histogram, see clusterSlots
+let histogramSlots = {};
+
+function clusterSlots(clusters) {
+    // app.cluster_slots: the clusters of the last histogram keep their
+    // slot, new ones take the free slots in order, so toggling a
+    // cluster moves no other
+    const slots = {};
+    clusters.forEach(function(c) {
+        if (histogramSlots[c] !== undefined) {
+            slots[c] = histogramSlots[c];
+        }
+    });
+    const taken = new Set(Object.values(slots));
+    let free = 0;
+    clusters.forEach(function(c) {
+        if (slots[c] === undefined) {
+            while (taken.has(free)) {
+                free++;
+            }
+            slots[c] = free;
+            taken.add(free);
+        }
+    });
+    histogramSlots = slots;
+    return slots;
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    retweet: {
+        build_histogram: function(store, clusters) {
+            if (!store || !clusters) {
+                return window.dash_clientside.no_update;
+            }
+
+            const arrays = decodeStore(store);
+            const index = {};
+            store.clusters.forEach(function(c, code) { index[c] = code; });
+
+            // In sorted order like the cached figures, every cluster in
+            // the band and color of its slot, see component_bounds
+            clusters = Array.from(new Set(clusters)).sort();
+            const slots = clusterSlots(clusters);
+            const tickvals = [0.75];
+            const ticktext = ['Conflict'];
+            const y = new Float64Array(arrays.date.length);
+            const edgeTraces = [];
+            const nodeTraces = [];
+
+            clusters.forEach(function(c) {
+                const low = slots[c] + 2;
+                const high = low + 0.8;
+                const color = store.colorway[slots[c] % store.colorway.length];
+                tickvals.push((low + high) / 2);
+                ticktext.push(String(c).slice(0, 30));
+
+                // Empty clusters get empty traces, like cluster_scatter
+                const code = index[c];
+                const nodes = code === undefined ? [0, 0] :
+                    [store.node_offsets[code], store.node_offsets[code + 1]];
+                const edges = code === undefined ? [0, 0] :
+                    [store.edge_offsets[code], store.edge_offsets[code + 1]];
+
+                const nodeX = [];
+                const nodeY = [];
+                for (let n = nodes[0]; n < nodes[1]; n++) {
+                    y[n] = low + arrays.jitter[n] * (high - low);
+                    nodeX.push(arrays.date[n]);
+                    nodeY.push(y[n]);
+                }
+                nodeTraces.push({
+                    type: 'scatter',
+                    x: nodeX,
+                    y: nodeY,
+                    name: c,
+                    legendgroup: c,
+                    mode: 'markers',
+                    marker: {color: color},
+                    hoverinfo: 'skip',
+                    hovertemplate: '<i>Account:</i> No info yet'
+                });
+
+                const edgeX = [];
+                const edgeY = [];
+                for (let e = edges[0]; e < edges[1]; e++) {
+                    const start = arrays.src[e];
+                    const end = arrays.dst[e];
+                    edgeX.push(arrays.date[start], arrays.date[end], null);
+                    edgeY.push(y[start], y[end], null);
+                }
+                // The edge trace of cluster_scatter, its style is the
+                // first trace of the figure of the store
+                edgeTraces.push(Object.assign({}, store.figure.data[0], {
+                    x: edgeX, y: edgeY, legendgroup: c
+                }));
+            });
+
+            // WebGL above the threshold, like retweet_graph.retweet_scatter
+            const points = edgeTraces.concat(nodeTraces).reduce(function(n, t) {
+                return n + (t.mode === 'lines' ? t.x.length / 3 : t.x.length);
+            }, 0);
+            const type = points > store.webgl_threshold ? 'scattergl' : 'scatter';
+            edgeTraces.concat(nodeTraces).forEach(function(t) { t.type = type; });
+
+            // Edge traces first and conflicts last, like build_plot
+            const base = store.figure;
+            const layout = Object.assign({}, base.layout, {
+                yaxis: Object.assign({}, base.layout.yaxis, {
+                    tickvals: tickvals,
+                    ticktext: ticktext
+                })
+            });
+
+            return {
+                data: edgeTraces.concat(nodeTraces, base.data.slice(1)),
+                layout: layout
+            };
+        }
+    }
+});
@@ -0,0 +1,324 @@
+"""
+Benchmarks of the run_* functions behind the tabs, at several data sizes.
+
+Every size is a number of nodes and edges of the retweet (geo)networks,
+made by tiling the bundled networks: the nodes are copied, and edges of
+the original networks are drawn between random copies within the same
+cluster. The scaled arrays are written as .npz files to a temporary
+directory, the dashboard reads them like the bundled ones.
+
+For every function and size the wall time of each repeat is recorded,
+and the peak of the memory allocated by Python and NumPy (tracemalloc)
+in a separate run. The figure cache is disabled, the networks are
+loaded before timing (loading is timed as load_*), and derived caches
+are cleared between repeats. Results are written as JSON, with the
+commit they were measured on, to compare versions:
+
+    python benchmark.py --sizes 100000:500000 1000000:5000000
+
+The similarity graph and the cluster explanation only exist at their
+bundled size, they are benchmarked at the first size.
+"""
+
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import config
+import data
+from graph_arrays import NODE_FIELDS, arrays_path, sort_arrays
+
+LANGUAGE = 'all'
+
+
+def scale_arrays(arrays, nodes, edges, seed=0):
+    """
+    Columnar arrays with at least nodes nodes, copies of the nodes of
+    arrays, and exactly edges edges
+
+    Return: dict(np.ndarray)
+    """
+
+    rng = np.random.default_rng(seed)
+    n = len(arrays['node_id'])
+    copies = max(1, math.ceil(nodes / n))
+
+    copy = np.repeat(np.arange(copies), n)
+    node_id = np.char.add(
+        np.tile(arrays['node_id'], copies),
+        np.char.add('_', copy.astype(str))
+    )
+    fields = {
+        field: np.tile(arrays[field], copies)
+        for field in NODE_FIELDS if field in arrays
+    }
+
+    # Original edges between random copies of their endpoints, within
+    # a cluster like the original edges
+    original = rng.integers(len(arrays['src']), size=edges)
+    src = arrays['src'][original] + n * rng.integers(copies, size=edges)
+    dst = arrays['dst'][original] + n * rng.integers(copies, size=edges)
+
+    return sort_arrays(
+        node_id,
+        np.tile(arrays['cluster'], copies),
+        arrays['cluster_names'],
+        np.tile(arrays['date'], copies),
+        np.stack([src, dst], axis=1),
+        fields
+    )
+
+
+def write_scaled(directory, nodes, edges, seed=0):
+    """
+    Writes the scaled network and geonetwork of LANGUAGE to directory,
+    and points data to them
+
+    Return: dict(str -> tuple(int, int)), nodes and edges per network
+    """
+
+    sizes = {}
+    for networks in (data.RETWEET_NETWORKS, data.RETWEET_GEONETWORKS):
+        original = data.load_graph_arrays(networks[LANGUAGE])
+        if nodes is None:
+            arrays = original
+        else:
+            arrays = scale_arrays(original, nodes, edges, seed)
+
+        path = os.path.join(
+            directory, os.path.basename(networks[LANGUAGE])
+        )
+        np.savez(arrays_path(path), **arrays)
+        networks[LANGUAGE] = path
+        sizes[os.path.basename(path)] = (
+            len(arrays['node_id']), len(arrays['src'])
+        )
+
+    return sizes
+
+
+def clear_caches():
+    """
+    Empties the caches of results derived from the networks
+    """
+
+    import frequencies
+    import retweet_graph
+
+    frequencies._CACHE.clear()
+    data._JITTER.clear()
+    retweet_graph.conflict_trace.cache_clear()
+
+
+def calls(clusters, start, end):
+    """
+    The benchmarked calls, name -> (function, args, every size)
+
+    Return: dict(name -> tuple(function, tuple, bool))
+    """
+
+    from analyses_graph import run_analyses_graph
+    from analyses_heatmap import run_analyses_heatmap
+    from analyses_scores import run_analyses_scores
+    from doc_explain import run_doc_explain
+    from retweet_geograph import run_retweet_geograph
+    from retweet_graph import run_retweet_graph
+    from similarity_graph import run_similarity_graph
+
+    return {
+        'load_retweet_network': (
+            lambda: (data._GRAPH_CACHE.clear(),
+                     data.load_retweet_network(LANGUAGE)),
+            (), True
+        ),
+        'load_retweet_geonetwork': (
+            lambda: (data._GRAPH_CACHE.clear(),
+                     data.load_retweet_geonetwork(LANGUAGE)),
+            (), True
+        ),
+        'run_retweet_graph': (
+            run_retweet_graph, (LANGUAGE, clusters, start, end), True
+        ),
+        'run_retweet_geograph': (
+            run_retweet_geograph, (LANGUAGE, clusters, start, end), True
+        ),
+        'run_analyses_graph': (
+            run_analyses_graph, (LANGUAGE, clusters, start, end, 'D'), True
+        ),
+        'run_analyses_heatmap': (
+            run_analyses_heatmap, (LANGUAGE, start, end, 'D', 30), True
+        ),
+        'run_analyses_scores': (
+            run_analyses_scores,
+            (LANGUAGE, clusters, start, end, config.DEFAULT_MAX_LAG), True
+        ),
+        'run_similarity_graph': (run_similarity_graph, (start, end), False),
+        'run_doc_explain': (run_doc_explain, (), False),
+    }
+
+
+def measure(function, args, repeat):
+    """
+    Wall time of every repeat, after a first untimed run, and the peak
+    traced memory of one more run
+
+    Return: list(float), int
+    """
+
+    # The first call of a process also builds the validators of plotly
+    clear_caches()
+    function(*args)
+
+    seconds = []
+    for _ in range(repeat):
+        clear_caches()
+        start = time.perf_counter()
+        function(*args)
+        seconds.append(time.perf_counter() - start)
+
+    clear_caches()
+    tracemalloc.start()
+    try:
+        function(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return seconds, peak
+
+
+def commit():
+    """
+    Commit of the working tree, None outside a git checkout
+
+    Return: str
+    """
+
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, repeat=3, only=None, seed=0):
+    """
+    Benchmarks every call at every size, sizes are (nodes, edges) with
+    None for the bundled networks
+
+    Return: list(dict)
+    """
+
+    config.FIGURE_CACHE = False
+    originals = (dict(data.RETWEET_NETWORKS), dict(data.RETWEET_GEONETWORKS))
+    clusters = data.load_retweet_network(LANGUAGE)['cluster_names'][:3]
+    clusters = clusters.tolist()
+
+    results = []
+    for i, (nodes, edges) in enumerate(sizes):
+        with tempfile.TemporaryDirectory() as directory:
+            networks = write_scaled(directory, nodes, edges, seed)
+            data._GRAPH_CACHE.clear()
+
+            for name, (function, args, scaled) in calls(
+                clusters, config.DEFAULT_START_DATE, config.DEFAULT_END_DATE
+            ).items():
+                if (only and name not in only) or (i and not scaled):
+                    continue
+                # Load the networks outside of the timing
+                data.load_retweet_network(LANGUAGE)
+                data.load_retweet_geonetwork(LANGUAGE)
+
+                result = {
+                    'function': name,
+                    'size': 'bundled' if nodes is None else f"{nodes}:{edges}",
+                    'networks': networks,
+                }
+                try:
+                    seconds, peak = measure(function, args, repeat)
+                except (OSError, KeyError) as error:
+                    result['error'] = f"{type(error).__name__}: {error}"
+                else:
+                    result.update({
+                        'seconds': seconds,
+                        'min': min(seconds),
+                        'median': statistics.median(seconds),
+                        'peak_bytes': peak,
+                    })
+                results.append(result)
+                print(format_result(result), flush=True)
+
+        data.RETWEET_NETWORKS.update(originals[0])
+        data.RETWEET_GEONETWORKS.update(originals[1])
+        data._GRAPH_CACHE.clear()
+
+    return results
+
+
+def format_result(result):
+    """
+    One line summary of a result
+
+    Return: str
+    """
+
+    size = f"{result['size']:>15}"
+    if 'error' in result:
+        return f"{result['function']:<24} {size}  {result['error']}"
+    return (f"{result['function']:<24} {size}  "
+            f"{result['median']:8.3f}s  "
+            f"{result['peak_bytes'] / 2 ** 20:8.1f} MB")
+
+
+def parse_size(text):
+    """
+    'nodes:edges' as integers
+
+    Return: tuple(int, int)
+    """
+
+    nodes, edges = text.split(':')
+    return int(nodes), int(edges)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '--sizes', nargs='*', type=parse_size,
+        default=[(100000, 500000), (1000000, 5000000)],
+        help="nodes:edges of the scaled networks, after the bundled ones"
+    )
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='*', help="names of the calls")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark.json')
+    options = parser.parse_args()
+
+    results = run(
+        [(None, None)] + options.sizes, options.repeat, options.only,
+        options.seed
+    )
+    with open(options.output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'commit': commit(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'repeat': options.repeat,
+            'results': results,
+        }, f, indent=2)
+    print(f"results written to {options.output}")
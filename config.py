@@ -0,0 +1,94 @@
+"""
+Settings of the dashboard, read from environment variables so they can
+be changed per deployment without touching the code.
+"""
+
+import importlib.util
+import os
+
+
+def env_bool(name, default=False):
+    """
+    Boolean environment variable, '1', 'true' and 'yes' are True
+
+    Return: bool
+    """
+
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes')
+
+
+# Pool building independent figures, 'thread' or 'process', and its size
+FIGURE_POOL = os.environ.get('FIGURE_POOL', 'thread')
+FIGURE_WORKERS = int(os.environ.get('FIGURE_WORKERS', 4))
+
+# Also build the figures of the hidden tabs, next to the visible one
+PREFETCH_TABS = env_bool('PREFETCH_TABS')
+
+# Figure cache shared by the workers, see figure_cache.py
+FIGURE_CACHE = env_bool('FIGURE_CACHE', default=True)
+FIGURE_CACHE_DIR = os.environ.get('FIGURE_CACHE_DIR', '.figure_cache')
+FIGURE_CACHE_SIZE_MB = int(os.environ.get('FIGURE_CACHE_SIZE_MB', 256))
+
+# Ship the retweet network to the browser once per language and filter
+# the clusters of the histogram there, see assets/clientside.js
+CLIENTSIDE_FILTERING = env_bool('CLIENTSIDE_FILTERING')
+
+# Compress responses (gzip / brotli, as the browser accepts), needs
+# flask-compress
+COMPRESS = env_bool(
+    'COMPRESS', default=importlib.util.find_spec('flask_compress') is not None
+)
+
+# Callback and figure metrics on /metrics, see metrics.py. The workers
+# share theirs through METRICS_DIR, else /metrics only has those of the
+# worker answering it.
+METRICS = env_bool('METRICS', default=True)
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+
+# Date window selected when the dashboard opens (inclusive)
+DEFAULT_START_DATE = os.environ.get('DEFAULT_START_DATE', '2016-01-01')
+DEFAULT_END_DATE = os.environ.get('DEFAULT_END_DATE', '2017-06-01')
+
+# Level of the logs of the dashboard (the startup report is INFO, the
+# time of every figure DEBUG), to stderr
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+
+# Import the figure modules and load the data when the app is imported,
+# instead of on the first request, see startup.py
+PRELOAD = env_bool('PRELOAD')
+
+# Resolutions of the tweet and conflict frequencies, see frequencies.py
+RESOLUTIONS = {
+    'D': 'Daily',
+    'W': 'Weekly',
+    'M': 'Monthly',
+}
+
+# The retweet timeline is drawn with WebGL (Scattergl) above this many
+# points (nodes and edges), SVG gets slow with tens of thousands
+WEBGL_THRESHOLD = int(os.environ.get('WEBGL_THRESHOLD', 10000))
+
+# At most this many points of the retweet timeline are drawn, larger
+# windows are sampled until zoomed in, see retweet_graph.downsample
+LOD_MAX_POINTS = int(os.environ.get('LOD_MAX_POINTS', 50000))
+
+# Above this many points (nodes and edges) the retweet timeline and the
+# geo map are drawn as a density image on the server, with a sample of
+# the nodes as markers on top, see raster.py. 0 never does.
+RASTER_THRESHOLD = int(os.environ.get('RASTER_THRESHOLD', 0))
+RASTER_WIDTH = int(os.environ.get('RASTER_WIDTH', 1200))
+RASTER_HEIGHT = int(os.environ.get('RASTER_HEIGHT', 600))
+RASTER_OVERLAY_POINTS = int(os.environ.get('RASTER_OVERLAY_POINTS', 5000))
+
+# Retweets of the geo map between the same places are drawn as one line
+# per cluster, wider the more it counts, places being locations rounded
+# to GEO_FLOW_DECIMALS decimals of a degree (1 is about 10 km), see
+# retweet_geograph.aggregate_flows
+GEO_FLOWS = env_bool('GEO_FLOWS', default=True)
+GEO_FLOW_DECIMALS = int(os.environ.get('GEO_FLOW_DECIMALS', 1))
+
+# Lags (in days, both directions) searched for the best Pearson r
+DEFAULT_MAX_LAG = int(os.environ.get('DEFAULT_MAX_LAG', 7))
@@ -1,10 +1,37 @@
+import functools
+import os
+import threading
+
+import numpy as np
 import pandas as pd
 
+from graph_arrays import arrays_path, read_arrays
+
+RETWEET_NETWORKS = {
+    'all': 'new_graphs/retweet_network.pickle',
+    'english': 'new_graphs/retweet_network_english.pickle',
+    'russian': 'new_graphs/retweet_network_russian.pickle',
+}
+
+RETWEET_GEONETWORKS = {
+    'all': 'new_graphs/retweet_geonetwork.pickle',
+    'english': 'new_graphs/retweet_geonetwork_english.pickle',
+    'russian': 'new_graphs/retweet_geonetwork_russian.pickle',
+}
+
+# path -> (mtimes, arrays), shared by every callback in this process
+_GRAPH_CACHE = {}
+_GRAPH_CACHE_LOCK = threading.Lock()
+
+# id of the node ids of loaded arrays -> (node ids, jitter), see node_jitter
+_JITTER = {}
+
 
 def import_conflict_data(file_name):
     """
     Imports conflict data from data directory.
-    And filters it based on a upper and lower bound date (datetime)
+    Sorted on date_start, so date windows can be selected with a
+    binary search (conflict_window)
 
     Returns pd.DataFrame
     """
@@ -18,4 +45,191 @@ def import_conflict_data(file_name):
     conflict_df['date_start'] = pd.to_datetime(conflict_df['date_start'])
     conflict_df['date_end'] = pd.to_datetime(conflict_df['date_end'])
 
+    conflict_df = conflict_df.sort_values('date_start', kind='stable')
+    conflict_df = conflict_df.reset_index(drop=True)
+
     return conflict_df
+
+
+@functools.lru_cache(maxsize=None)
+def conflict_data():
+    """
+    The conflicts in Ukraine, imported once per process and shared,
+    never modify it
+
+    Returns pd.DataFrame
+    """
+
+    return import_conflict_data('conflict_data_ukr.csv')
+
+
+def conflict_window(conflict_df, start=None, end=None):
+    """
+    Conflicts of a date sorted conflict_df that start within
+    [start, end], both optional and inclusive. A binary search and a
+    slice, no copy or scan of the frame.
+
+    Returns pd.DataFrame
+    """
+
+    dates = conflict_df['date_start'].values
+    low, high = 0, len(dates)
+    if start is not None:
+        low = np.searchsorted(dates, pd.Timestamp(start).to_datetime64())
+    if end is not None:
+        # The whole end day is in the window
+        high = np.searchsorted(
+            dates, (pd.Timestamp(end) + pd.Timedelta(days=1)).to_datetime64()
+        )
+
+    return conflict_df.iloc[low:max(low, high)]
+
+
+def hash_strings(keys):
+    """
+    Stable 64 bit hashes of an array of strings: FNV-1a over the
+    characters, one pass per character over all keys at once, and the
+    finalizer of MurmurHash3 to spread the bits. The padding of fixed
+    width arrays is skipped, a key gets the same hash in every array.
+
+    Return: np.ndarray (uint64)
+    """
+
+    keys = np.asarray(keys)
+    unit = np.uint8 if keys.dtype.kind == 'S' else np.uint32
+    width = keys.dtype.itemsize // np.dtype(unit).itemsize
+    units = np.ascontiguousarray(keys).view(unit).reshape(len(keys), width)
+
+    hashes = np.full(len(keys), 0xcbf29ce484222325, dtype=np.uint64)
+    prime = np.uint64(0x100000001b3)
+    with np.errstate(over='ignore'):
+        for column in units.T:
+            # A contiguous copy, the columns are strided
+            column = column.astype(np.uint64)
+            hashes = np.where(
+                column != 0, (hashes ^ column) * prime, hashes
+            )
+        for shift, multiplier in (
+            (33, 0xff51afd7ed558ccd), (33, 0xc4ceb9fe1a85ec53), (33, None)
+        ):
+            hashes ^= hashes >> np.uint64(shift)
+            if multiplier is not None:
+                hashes *= np.uint64(multiplier)
+
+    return hashes
+
+
+def stable_uniform(keys, low, high):
+    """
+    Numbers in [low, high) derived from a stable hash of the keys, the
+    same key always gets the same number, in every process and run.
+    Used as deterministic jitter, low and high can be arrays.
+
+    Return: np.ndarray
+    """
+
+    keys = np.asarray(keys)
+    if keys.dtype.kind in 'US':
+        hashes = hash_strings(keys)
+    else:
+        if keys.dtype.kind not in 'iu':
+            keys = keys.astype(object)
+        # Integers are hashed directly, much faster than as objects
+        hashes = pd.util.hash_array(keys)
+    # The top 53 bits fill the mantissa of a float in [0, 1)
+    unit = (hashes >> np.uint64(11)) * (1.0 / 2 ** 53)
+
+    return low + unit * (high - low)
+
+
+def node_jitter(G):
+    """
+    stable_uniform in [0, 1) of every node id of the graph arrays G,
+    hashed once per loaded graph
+
+    Return: np.ndarray
+    """
+
+    node_id = G['node_id']
+    cached = _JITTER.get(id(node_id))
+    if cached is None or cached[0] is not node_id:
+        jitter = stable_uniform(node_id, 0, 1)
+        jitter.flags.writeable = False
+        with _GRAPH_CACHE_LOCK:
+            # Forget the jitter of graphs that are no longer loaded
+            loaded = {
+                id(arrays['node_id']) for _, arrays in _GRAPH_CACHE.values()
+            }
+            for key in [key for key in _JITTER if key not in loaded]:
+                del _JITTER[key]
+            cached = _JITTER[id(node_id)] = (node_id, jitter)
+
+    return cached[1]
+
+
+def load_graph_arrays(path):
+    """
+    Loads the columnar arrays of a pickled graph once per process, and
+    only reloads them when the modification time of the pickle or its
+    .npz changes.
+    The arrays are shared between callbacks, never write into them.
+
+    Return: dict(np.ndarray)
+    """
+
+    mtime = tuple(
+        os.path.getmtime(p) if os.path.exists(p) else None
+        for p in (path, arrays_path(path))
+    )
+    cached = _GRAPH_CACHE.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with _GRAPH_CACHE_LOCK:
+        # Another thread may have loaded it while we waited
+        cached = _GRAPH_CACHE.get(path)
+        if cached is None or cached[0] != mtime:
+            arrays = read_arrays(path)
+            for array in arrays.values():
+                array.flags.writeable = False
+            # Converting may have written the .npz
+            mtime = tuple(
+                os.path.getmtime(p) if os.path.exists(p) else None
+                for p in (path, arrays_path(path))
+            )
+            cached = _GRAPH_CACHE[path] = (mtime, arrays)
+
+    return cached[1]
+
+
+def load_retweet_network(language):
+    """
+    Cached retweet network of a language ('all', 'english', 'russian')
+
+    Return: dict(np.ndarray)
+    """
+
+    return load_graph_arrays(RETWEET_NETWORKS[language])
+
+
+def load_retweet_geonetwork(language):
+    """
+    Cached retweet geonetwork of a language ('all', 'english', 'russian')
+
+    Return: dict(np.ndarray)
+    """
+
+    return load_graph_arrays(RETWEET_GEONETWORKS[language])
+
+
+def preload():
+    """
+    Loads the conflict data and the (geo)network of every language,
+    which are otherwise loaded by the first request needing them
+    """
+
+    conflict_data()
+    for language in RETWEET_NETWORKS:
+        load_retweet_network(language)
+    for language in RETWEET_GEONETWORKS:
+        load_retweet_geonetwork(language)
@@ -0,0 +1,123 @@
+"""
+Compact JSON of figures and other callback results.
+
+NumPy arrays of numbers are sent as plotly.js typed arrays: the base64
+of their bytes and their dtype, {'dtype': 'f8', 'bdata': ...}, which
+plotly.js (2.28 and later) reads without parsing a list of numbers.
+Dates become milliseconds since the epoch, which date axes accept, with
+NaN for NaT gaps. JSON is written with orjson when it is installed.
+"""
+
+import base64
+import datetime
+import json
+import math
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# NumPy dtypes plotly.js has typed arrays for
+TYPED_ARRAYS = {
+    'int8': 'i1', 'uint8': 'u1', 'int16': 'i2', 'uint16': 'u2',
+    'int32': 'i4', 'uint32': 'u4', 'float32': 'f4', 'float64': 'f8',
+}
+
+
+def typed_array(values):
+    """
+    A plotly.js typed array of a numeric, boolean or datetime array
+
+    Return: dict
+    """
+
+    if values.dtype.kind == 'M':
+        dates = values.astype('datetime64[ms]')
+        values = dates.astype(np.int64).astype(np.float64)
+        values[np.isnat(dates)] = np.nan
+    elif values.dtype.kind == 'b':
+        values = values.astype(np.uint8)
+    elif values.dtype.name not in TYPED_ARRAYS:
+        # 64 bit integers, as int32 when they fit
+        fits = values.size == 0 or (
+            values.min() >= np.iinfo(np.int32).min
+            and values.max() <= np.iinfo(np.int32).max
+        )
+        values = values.astype(np.int32 if fits else np.float64)
+
+    values = np.ascontiguousarray(values, values.dtype.newbyteorder('<'))
+    spec = {
+        'dtype': TYPED_ARRAYS[values.dtype.name],
+        'bdata': base64.b64encode(values.tobytes()).decode('ascii'),
+    }
+    if values.ndim > 1:
+        spec['shape'] = ','.join(map(str, values.shape))
+
+    return spec
+
+
+def encode(value):
+    """
+    value with only JSON types: figures as dicts, numeric arrays as
+    typed arrays, other arrays as lists, dates as ISO strings and NaN
+    as None
+
+    Return: object
+    """
+
+    # Scalars first, lists of them are the most common
+    if value is None or isinstance(value, (str, bool, int)):
+        return value
+    if isinstance(value, float):
+        # float() of np.float64, a subclass orjson does not take
+        return None if math.isnan(value) else float(value)
+
+    if hasattr(value, 'to_plotly_json'):
+        value = value.to_plotly_json()
+    if isinstance(value, dict):
+        return {key: encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    if hasattr(value, 'values') and hasattr(value, 'dtype'):
+        # pandas Series and Index
+        value = np.asarray(value.values)
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind in 'biufM':
+            return typed_array(value)
+        return [encode(item) for item in value.tolist()]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+
+    return value
+
+
+def dumps(value):
+    """
+    JSON of encode(value)
+
+    Return: bytes
+    """
+
+    value = encode(value)
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value).encode()
+
+
+def loads(text):
+    """
+    The value of a JSON text
+
+    Return: object
+    """
+
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
@@ -0,0 +1,313 @@
+"""
+Figure cache shared by every worker of the dashboard.
+
+Results of the decorated run_* functions are stored as JSON files in
+FIGURE_CACHE_DIR, with numeric arrays as typed arrays (see encoding.py),
+keyed on the function, its arguments with cluster lists as a canonical
+(sorted, unique) set, and a version of the data files, of the code and
+of the settings shaping the figures. Entries are evicted least recently
+used first once the directory grows over FIGURE_CACHE_SIZE_MB.
+
+Precompute the common selections at deploy time with:
+
+    python figure_cache.py warmup
+"""
+
+import functools
+import hashlib
+import json
+import os
+import sys
+import uuid
+
+import config
+import encoding
+import metrics
+
+DATA_DIRS = ('data', 'new_graphs')
+# Networks larger than the pickle limit of generate_data.py only exist
+# as their .npz (see graph_arrays.py)
+DATA_SUFFIXES = ('.pickle', '.csv', '.npz')
+
+# Format of the cached figures, bump it when figures change in a way the
+# code version misses. The patches of run_retweet_patch and
+# run_retweet_geopatch rely on the traces of the cached figures.
+FIGURE_FORMAT = 1
+
+# Settings of config changing the traces of a figure
+FIGURE_SETTINGS = (
+    'WEBGL_THRESHOLD', 'LOD_MAX_POINTS', 'RASTER_THRESHOLD', 'RASTER_WIDTH',
+    'RASTER_HEIGHT', 'RASTER_OVERLAY_POINTS', 'GEO_FLOWS',
+    'GEO_FLOW_DECIMALS',
+)
+
+# name -> decorated function, used by warmup
+FUNCTIONS = {}
+
+
+def data_version():
+    """
+    Hash of the name, size and mtime of every data file, changes when
+    any of the data is replaced
+
+    Return: str
+    """
+
+    h = hashlib.sha1()
+    for directory in DATA_DIRS:
+        if not os.path.isdir(directory):
+            continue
+        for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+            if entry.name.endswith(DATA_SUFFIXES):
+                stat = entry.stat()
+                h.update(f"{entry.path}:{stat.st_size}:{stat.st_mtime_ns}\n"
+                         .encode())
+    return h.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+    """
+    Hash of the modules of the dashboard, changes with a deploy of other
+    code. Read once per process, the code does not change while it runs.
+
+    Return: str
+    """
+
+    h = hashlib.sha1()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+        if entry.name.endswith('.py'):
+            with open(entry.path, 'rb') as f:
+                h.update(entry.name.encode() + b'\n' + f.read())
+    return h.hexdigest()
+
+
+def version():
+    """
+    Version of the cached figures: of the data, the code, the format and
+    the settings shaping them
+
+    Return: list()
+    """
+
+    return [
+        data_version(), code_version(), FIGURE_FORMAT,
+        {name: getattr(config, name) for name in FIGURE_SETTINGS},
+    ]
+
+
+def canonical(value):
+    """
+    Canonical form of an argument, a selection of clusters does not
+    depend on its order or duplicates
+
+    Return: object
+    """
+
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sorted(set(value))
+    if isinstance(value, dict):
+        return dict(sorted(value.items()))
+    return value
+
+
+def cache_key(name, args, kwargs, version):
+    """
+    Key of a call in the cache
+
+    Return: str
+    """
+
+    call = json.dumps([name, args, sorted(kwargs.items()), version])
+    return hashlib.sha1(call.encode()).hexdigest()
+
+
+def _read(path):
+    try:
+        with open(path, 'rb') as f:
+            entry = encoding.loads(f.read())
+        # Mark as recently used for the eviction
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    return entry
+
+
+def _write(path, entry):
+    # Write to a temporary file first, other workers may be reading it
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(entry)
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+def entries(directory=None):
+    """
+    Files in the cache, most recently used first
+
+    Return: list(os.DirEntry)
+    """
+
+    directory = directory or config.FIGURE_CACHE_DIR
+    if not os.path.isdir(directory):
+        return []
+
+    found = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.json'):
+            try:
+                found.append((entry.stat().st_mtime, entry))
+            except OSError:
+                pass
+    found.sort(key=lambda item: item[0], reverse=True)
+
+    return [entry for _, entry in found]
+
+
+def evict(directory=None, max_bytes=None):
+    """
+    Removes the least recently used entries until the cache fits in
+    max_bytes
+    """
+
+    if max_bytes is None:
+        max_bytes = config.FIGURE_CACHE_SIZE_MB * 1024 * 1024
+
+    total = 0
+    for entry in entries(directory):
+        try:
+            total += entry.stat().st_size
+            if total > max_bytes:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def cached_figure(function):
+    """
+    Decorator storing the result of a run_* function in the shared cache.
+    Cluster lists are passed on sorted, so every order of a selection
+    gives the same figure. Returns the result as plain JSON (dict / list)
+    with typed arrays, which Dash sends as is.
+    """
+
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        args = [canonical(arg) for arg in args]
+        kwargs = {key: canonical(value) for key, value in kwargs.items()}
+        if not config.FIGURE_CACHE:
+            return encoding.encode(function(*args, **kwargs))
+
+        os.makedirs(config.FIGURE_CACHE_DIR, exist_ok=True)
+        key = cache_key(name, args, kwargs, version())
+        path = os.path.join(config.FIGURE_CACHE_DIR, f"{key}.json")
+
+        entry = _read(path)
+        if entry is not None:
+            if config.METRICS:
+                metrics.FIGURE_CACHE.inc(name, 'hit')
+            return entry['result']
+
+        if config.METRICS:
+            metrics.FIGURE_CACHE.inc(name, 'miss')
+        result = encoding.encode(function(*args, **kwargs))
+        text = encoding.dumps({
+            'function': name,
+            'args': args,
+            'kwargs': kwargs,
+            'result': result,
+        })
+        _write(path, text)
+        evict()
+
+        return result
+
+    FUNCTIONS[name] = wrapper
+    return wrapper
+
+
+def common_calls(top=50):
+    """
+    Calls to precompute: the default selection of every language and the
+    top most recently used calls in the cache (of any version)
+
+    Return: list(tuple(name, args, kwargs))
+    """
+
+    from data import RETWEET_NETWORKS, load_retweet_network
+
+    calls = []
+    for language in RETWEET_NETWORKS:
+        # The first three clusters, like update_graph_initial
+        clusters = load_retweet_network(language)['cluster_names'][:3]
+        clusters = clusters.tolist()
+        window = [config.DEFAULT_START_DATE, config.DEFAULT_END_DATE]
+        calls += [
+            ('run_retweet_graph', [language, clusters] + window, {}),
+            ('run_retweet_geograph', [language, clusters] + window, {}),
+            ('run_analyses_graph', [language, clusters] + window + ['D'],
+             {}),
+            ('run_analyses_heatmap', [language] + window + ['D', 30], {}),
+            ('run_analyses_scores',
+             [language, clusters] + window + [config.DEFAULT_MAX_LAG], {}),
+        ]
+
+    for entry in entries()[:top]:
+        try:
+            with open(entry.path, encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            continue
+        calls.append((stored['function'], stored['args'], stored['kwargs']))
+
+    # Keep the first of every call
+    unique = {}
+    for name, args, kwargs in calls:
+        key = json.dumps([name, args, sorted(kwargs.items())])
+        unique.setdefault(key, (name, args, kwargs))
+
+    return list(unique.values())
+
+
+def warmup(top=50):
+    """
+    Precomputes the common calls for the current version
+    """
+
+    from figures import build_figures
+
+    # Register the cached functions
+    import analyses_graph  # noqa: F401
+    import analyses_heatmap  # noqa: F401
+    import analyses_scores  # noqa: F401
+    import retweet_geograph  # noqa: F401
+    import retweet_graph  # noqa: F401
+
+    jobs = {
+        f"{name}{args}": (
+            functools.partial(FUNCTIONS[name], **kwargs), tuple(args)
+        )
+        for name, args, kwargs in common_calls(top)
+        if name in FUNCTIONS
+    }
+    _, timings = build_figures(jobs)
+    for job, seconds in timings.items():
+        print(f"{seconds:8.3f}s {job}")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] != ['warmup']:
+        sys.exit("usage: python figure_cache.py warmup [top]")
+
+    # The run_* modules register in the imported module, not in __main__
+    import figure_cache
+    figure_cache.warmup(*map(int, sys.argv[2:3]))
@@ -0,0 +1,153 @@
+"""
+Builds independent figures concurrently, so the latency of a callback is
+close to its slowest figure instead of the sum of all of them.
+"""
+
+import bisect
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import dash
+
+import config
+import encoding
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool():
+    """
+    The pool of the process, created on first use with FIGURE_POOL and
+    FIGURE_WORKERS from config
+
+    Return: concurrent.futures.Executor
+    """
+
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            if config.FIGURE_POOL == 'process':
+                _POOL = ProcessPoolExecutor(config.FIGURE_WORKERS)
+            else:
+                _POOL = ThreadPoolExecutor(
+                    config.FIGURE_WORKERS, thread_name_prefix='figures'
+                )
+    return _POOL
+
+
+def _timed(function, args, kwargs=None):
+    start = time.perf_counter(), time.thread_time()
+    result = function(*args, **(kwargs or {}))
+    return (
+        result,
+        time.perf_counter() - start[0],
+        time.thread_time() - start[1],
+    )
+
+
+def function_name(function):
+    """
+    Name of a function, of a partial or of a startup.lazy function
+
+    Return: str
+    """
+
+    if isinstance(function, functools.partial):
+        return function_name(function.func)
+    return getattr(function, '__name__', type(function).__name__)
+
+
+def record(function, seconds, cpu_seconds, result):
+    """
+    Adds the wall and CPU time of a call of function, and the size of
+    its serialized result, to the metrics. Every result is measured,
+    cached or not, patches too.
+    """
+
+    if config.METRICS:
+        name = function_name(function)
+        metrics.FIGURE_SECONDS.observe(name, seconds)
+        metrics.FIGURE_CPU_SECONDS.observe(name, cpu_seconds)
+        metrics.FIGURE_BYTES.observe(name, len(encoding.dumps(result)))
+
+
+def call(function, *args, **kwargs):
+    """
+    Calls function in this thread, timed like the jobs of build_figures
+
+    Return: the result of function
+    """
+
+    result, seconds, cpu_seconds = _timed(function, args, kwargs)
+    record(function, seconds, cpu_seconds, result)
+    return result
+
+
+def build_figures(jobs):
+    """
+    Runs jobs, a dict of name -> (function, args), concurrently.
+    A single job runs in the calling thread. Every timing goes to the
+    figure metrics (see metrics.py) and is logged at DEBUG.
+
+    Return: dict(name -> result), dict(name -> seconds)
+    """
+
+    if len(jobs) <= 1 or config.FIGURE_WORKERS <= 1:
+        done = {
+            name: _timed(function, args)
+            for name, (function, args) in jobs.items()
+        }
+    else:
+        pool = get_pool()
+        futures = {
+            name: pool.submit(_timed, function, args)
+            for name, (function, args) in jobs.items()
+        }
+        done = {name: future.result() for name, future in futures.items()}
+
+    results = {name: result for name, (result, _, _) in done.items()}
+    timings = {name: seconds for name, (_, seconds, _) in done.items()}
+    for name, (result, seconds, cpu_seconds) in done.items():
+        logger.debug("built %s in %.3fs", name, seconds)
+        record(jobs[name][0], seconds, cpu_seconds, result)
+
+    return results, timings
+
+
+def patch_clusters(previous, clusters, cluster_traces, groups=2):
+    """
+    dash.Patch of a figure whose data starts with groups of one trace
+    per cluster, groups of them in the sorted order of the clusters
+    (e.g. all edge traces, then all node traces), from the sorted clusters
+    previous to clusters. The traces of removed clusters are deleted,
+    cluster_traces(c) gives the traces of an added cluster c, one per
+    group. Operations apply in order, indices are of the data so far.
+
+    Return: dash.Patch
+    """
+
+    patch = dash.Patch()
+    current = list(previous)
+    for c in previous:
+        if c not in clusters:
+            i, n = current.index(c), len(current)
+            # Last group first, the earlier positions do not move
+            for group in reversed(range(groups)):
+                del patch['data'][group * n + i]
+            current.remove(c)
+
+    for c in clusters:
+        if c not in current:
+            i = bisect.bisect(current, c)
+            for group, trace in enumerate(cluster_traces(c)):
+                patch['data'].insert(group * (len(current) + 1) + i, trace)
+            current.insert(i, c)
+
+    return patch
@@ -0,0 +1,140 @@
+"""
+Tweet and conflict frequencies, computed from the retweet network and
+the conflict data instead of a separately maintained CSV.
+
+Daily counts are one np.bincount over day index x cluster code, weekly
+and monthly counts sum the days. Results are cached per language and
+resolution, and recomputed when the network is reloaded.
+
+Conflicts are counted on every day they are active, from date_start up
+to but not including date_end, like the CSV. Tweets are the nodes of
+the retweet network, fewer than the CSV counted: from 2016-01 to
+2017-06 of the bundled data 3640 against 8396.
+"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+from data import conflict_data, load_retweet_network
+
+
+# Resample rules, weeks start on monday and months on the first
+_RULES = {'W': 'W-MON', 'M': 'MS'}
+
+# (language, resolution) -> (arrays, frequencies_df)
+_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def daily_counts(dates, codes, n_codes, first_day, n_days):
+    """
+    Number of dates per day and code, days outside
+    [first_day, first_day + n_days) are skipped
+
+    Return: np.ndarray (n_days, n_codes)
+    """
+
+    days = (dates.astype('datetime64[D]') - first_day).astype(np.int64)
+    inside = (days >= 0) & (days < n_days)
+    flat = days[inside] * n_codes + codes[inside]
+
+    return np.bincount(flat, minlength=n_days * n_codes).reshape(
+        n_days, n_codes
+    )
+
+
+def active_counts(starts, ends, first_day, n_days):
+    """
+    Number of periods [start, end) active on every day of
+    [first_day, first_day + n_days), from the cumulative sum of +1 on
+    the start days and -1 on the end days
+
+    Return: np.ndarray (n_days,)
+    """
+
+    changes = np.zeros(n_days + 1, dtype=np.int64)
+    for dates, step in ((starts, 1), (ends, -1)):
+        days = (dates.astype('datetime64[D]') - first_day).astype(np.int64)
+        np.add.at(changes, np.clip(days, 0, n_days), step)
+
+    return np.cumsum(changes)[:n_days]
+
+
+def build_frequencies(G, conflict_df, resolution='D'):
+    """
+    Frequency of tweets per cluster, their sum and the frequency of
+    active conflicts (see active_counts), over the days of the tweets in
+    G. One row per day, week or month (resolution 'D', 'W' or 'M') with
+    the columns date, conflicts, every cluster and sum.
+
+    Return: pd.DataFrame
+    """
+
+    first_day = G['date'].min().astype('datetime64[D]')
+    last_day = G['date'].max().astype('datetime64[D]')
+    n_days = (last_day - first_day).astype(np.int64) + 1
+    names = G['cluster_names'].tolist()
+
+    tweets = daily_counts(
+        G['date'], G['cluster'].astype(np.int64), len(names),
+        first_day, n_days
+    )
+    conflicts = active_counts(
+        conflict_df['date_start'].values, conflict_df['date_end'].values,
+        first_day, n_days
+    )
+
+    frequencies_df = pd.DataFrame(
+        tweets, columns=names,
+        index=pd.date_range(str(first_day), periods=n_days, freq='D')
+    )
+    frequencies_df.insert(0, 'conflicts', conflicts)
+    if resolution in _RULES:
+        frequencies_df = frequencies_df.resample(
+            _RULES[resolution], label='left', closed='left'
+        ).sum()
+    frequencies_df['sum'] = frequencies_df[names].sum(axis=1)
+
+    frequencies_df.index.name = 'date'
+    return frequencies_df.reset_index()
+
+
+def tweet_frequencies(language, resolution='D'):
+    """
+    Cached build_frequencies of the retweet network of a language
+
+    Return: pd.DataFrame
+    """
+
+    G = load_retweet_network(language)
+    key = (language, resolution)
+    cached = _CACHE.get(key)
+    if cached is None or cached[0] is not G:
+        frequencies_df = build_frequencies(G, conflict_data(), resolution)
+        with _CACHE_LOCK:
+            cached = _CACHE[key] = (G, frequencies_df)
+
+    return cached[1]
+
+
+def frequencies_window(frequencies_df, start=None, end=None):
+    """
+    Rows of frequencies_df within [start, end], a binary search on the
+    sorted dates
+
+    Return: pd.DataFrame
+    """
+
+    dates = frequencies_df['date'].values
+    low, high = 0, len(dates)
+    if start is not None:
+        low = np.searchsorted(dates, pd.Timestamp(start).to_datetime64())
+    if end is not None:
+        high = np.searchsorted(
+            dates, pd.Timestamp(end).to_datetime64(), 'right'
+        )
+
+    return frequencies_df.iloc[low:max(low, high)]
+
@@ -0,0 +1,525 @@
+"""
+Synthetic data in the schemas and file layout of new_graphs/ and data/,
+to run and benchmark the dashboard at any size:
+
+    python generate_data.py --output synthetic --nodes 1000000 \\
+        --edges 5000000 --clusters 60
+    cd synthetic && python ../app.py
+
+The retweet (geo)networks of every language are streamed to their .npz
+(see graph_arrays.py) a chunk at a time, so their size is only limited
+by the disk. Up to --pickle-limit nodes the networkx pickles are written
+too. Edges are drawn independently, the .npz keeps the few drawn twice
+(or in both directions) while the undirected pickle merges them, so it
+has slightly fewer edges. The similarity network, the tables and the
+conflicts are small and written at once.
+
+Everything is drawn from --seed: the same arguments give the same files.
+"""
+
+import argparse
+import os
+import pickle
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from graph_arrays import FORMAT_VERSION, TWITTER_DATE_FORMAT, arrays_path
+
+# Share of the nodes and edges of the 'all' network in every language
+LANGUAGES = {
+    'all': ('', 1.0),
+    'english': ('_english', 0.3),
+    'russian': ('_russian', 0.7),
+}
+
+KEYWORDS = [
+    'the west', 'nazi/fascist', 'austria-hungary', 'protest', 'west',
+    'syrian war', 'euromaidan', 'big business', 'chernobyl', 'coup',
+    'anti-russian', 'hillary clinton', 'christianity', 'vladimir putin',
+    'nato', 'sanctions', 'crimea', 'donbass', 'mh17', 'referendum',
+]
+
+# Tweet ids are 18 digits, like the real ones
+TWEET_ID_BASE = 680000000000000000
+
+# Streams of random numbers, every field of every chunk has its own
+FIELDS = {
+    'cluster_sizes': 0, 'date': 1, 'lat': 2, 'long': 3, 'src': 4, 'dst': 5,
+    'center': 6,
+}
+
+
+def rng(seed, *stream):
+    """
+    Generator of one stream of numbers, independent of the others
+
+    Return: np.random.Generator
+    """
+
+    return np.random.default_rng([seed, *stream])
+
+
+def write_npz(path, arrays):
+    """
+    Writes arrays like np.savez, but one chunk at a time. arrays is a
+    dict of name -> (dtype, length, chunks), chunks an iterable of the
+    consecutive parts, length None for a scalar.
+    """
+
+    tmp = f"{path}.tmp"
+    with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for name, (dtype, length, chunks) in arrays.items():
+            dtype = np.dtype(dtype)
+            shape = () if length is None else (length,)
+            written = 0
+            with zf.open(f"{name}.npy", 'w', force_zip64=True) as f:
+                np.lib.format.write_array_header_1_0(f, {
+                    'descr': np.lib.format.dtype_to_descr(dtype),
+                    'fortran_order': False,
+                    'shape': shape,
+                })
+                for chunk in chunks:
+                    chunk = np.ascontiguousarray(chunk, dtype=dtype)
+                    f.write(chunk.tobytes())
+                    written += chunk.size
+            if written != (1 if length is None else length):
+                raise ValueError(f"{name}: wrote {written} of {length}")
+    os.replace(tmp, path)
+
+
+def cluster_names(n_clusters):
+    """
+    Sorted names of the clusters, like graph_arrays.graph_to_arrays
+
+    Return: np.ndarray
+    """
+
+    width = max(2, len(str(n_clusters - 1)))
+    return np.array(sorted(
+        f"Cluster {i:0{width}d}" for i in range(n_clusters)
+    ), dtype=str)
+
+
+class Network:
+    """
+    A retweet (geo)network drawn from a seed. Nodes are generated sorted
+    by cluster and date, edges sorted by cluster, so every array of the
+    columnar format can be streamed on its own.
+    """
+
+    def __init__(self, nodes, edges, n_clusters, start, end, seed,
+                 stream, geo=False, chunk=1000000):
+        self.names = cluster_names(n_clusters)
+        # In seconds, like the dates of tweets
+        self.start = pd.Timestamp(start).value // 10 ** 9
+        self.span = pd.Timestamp(end).value // 10 ** 9 - self.start
+        self.seed = seed
+        self.stream = stream
+        self.geo = geo
+        self.chunk = chunk
+
+        # Heavy tailed cluster sizes, like the real clusters
+        r = rng(seed, stream, FIELDS['cluster_sizes'])
+        weights = r.permutation(1 / np.arange(1, n_clusters + 1) ** 0.8)
+        self.node_counts = r.multinomial(nodes, weights / weights.sum())
+        if nodes:
+            self.edge_counts = r.multinomial(
+                edges, self.node_counts / nodes
+            )
+        else:
+            # No nodes to connect, a share of a language can round to 0
+            self.edge_counts = np.zeros(n_clusters, dtype=np.int64)
+        self.node_offsets = np.concatenate(
+            [[0], np.cumsum(self.node_counts)]
+        )
+        self.edge_offsets = np.concatenate(
+            [[0], np.cumsum(self.edge_counts)]
+        )
+
+    def parts(self, counts):
+        """
+        (code, first, size) of every chunk of every cluster
+
+        Return: generator(tuple(int, int, int))
+        """
+
+        for code, count in enumerate(counts):
+            for first in range(0, count, self.chunk):
+                yield code, first, min(self.chunk, count - first)
+
+    def cluster(self):
+        for code, _, size in self.parts(self.node_counts):
+            yield np.full(size, code, dtype=np.int16)
+
+    def node_id(self):
+        for code, first, size in self.parts(self.node_counts):
+            first += self.node_offsets[code] + TWEET_ID_BASE
+            yield np.arange(first, first + size).astype(str)
+
+    def date(self):
+        # Chunk i of a cluster of n nodes gets the i-th part of the span,
+        # sorting the chunk sorts the cluster
+        for code, first, size in self.parts(self.node_counts):
+            count = self.node_counts[code]
+            low = self.start + self.span * first // count
+            high = self.start + self.span * (first + size) // count
+            r = rng(self.seed, self.stream, FIELDS['date'], code, first)
+            dates = np.sort(r.integers(low, max(high, low + 1), size))
+            yield dates.astype('datetime64[s]').astype('datetime64[ms]')
+
+    def location(self, field):
+        # Tweets of a cluster around a center of the cluster
+        bounds = {'lat': 80, 'long': 180}[field]
+        centers = rng(
+            self.seed, self.stream, FIELDS['center'], FIELDS[field]
+        ).uniform(-bounds / 2, bounds / 2, len(self.names))
+        for code, first, size in self.parts(self.node_counts):
+            r = rng(self.seed, self.stream, FIELDS[field], code, first)
+            values = r.normal(centers[code], 10, size)
+            yield np.clip(values, -bounds, bounds)
+
+    def endpoints(self, field):
+        # Edges connect nodes of the same cluster
+        for code, first, size in self.parts(self.edge_counts):
+            r = rng(self.seed, self.stream, FIELDS[field], code, first)
+            yield self.node_offsets[code] + r.integers(
+                self.node_counts[code], size=size
+            )
+
+    def write(self, path):
+        """
+        Streams the columnar arrays to path
+        """
+
+        n = int(self.node_offsets[-1])
+        m = int(self.edge_offsets[-1])
+        arrays = {
+            'node_id': ('<U18', n, self.node_id()),
+            'cluster': (np.int16, n, self.cluster()),
+            'cluster_names': (self.names.dtype, len(self.names),
+                              [self.names]),
+            'node_offsets': (np.int64, len(self.node_offsets),
+                             [self.node_offsets]),
+            'date': ('datetime64[ms]', n, self.date()),
+        }
+        if self.geo:
+            arrays['lat'] = (np.float64, n, self.location('lat'))
+            arrays['long'] = (np.float64, n, self.location('long'))
+        arrays.update({
+            'src': (np.int32, m, self.endpoints('src')),
+            'dst': (np.int32, m, self.endpoints('dst')),
+            'edge_offsets': (np.int64, len(self.edge_offsets),
+                             [self.edge_offsets]),
+            'version': (np.int64, None, [np.array(FORMAT_VERSION)]),
+        })
+        write_npz(path, arrays)
+
+    def daily_counts(self, first_day, n_days):
+        """
+        Tweets per day and cluster, streamed like the dates
+
+        Return: np.ndarray (n_days, clusters)
+        """
+
+        counts = np.zeros((n_days, len(self.names)), dtype=np.int64)
+        parts = self.parts(self.node_counts)
+        for (code, _, _), dates in zip(parts, self.date()):
+            days = (dates.astype('datetime64[D]') - first_day).astype(int)
+            counts[:, code] += np.bincount(days, minlength=n_days)[:n_days]
+        return counts
+
+    def to_graph(self, language):
+        """
+        The networkx graph the pickles hold: dates as timestamps, or as
+        twitter strings in geonetworks. Python strings and floats, like
+        the original, not NumPy scalars. The edges drawn twice are
+        merged, the .npz of write keeps them.
+
+        Return: nx.Graph
+        """
+
+        import networkx as nx
+
+        ids = np.concatenate(list(self.node_id()) or [np.array([], str)])
+        codes = np.concatenate(list(self.cluster()) or [[]]).astype(int)
+        names = self.names.tolist()
+        dates = pd.to_datetime(np.concatenate(
+            list(self.date()) or [np.array([], 'datetime64[ms]')]
+        ))
+        if self.geo:
+            dates = dates.strftime(TWITTER_DATE_FORMAT.replace('%z', '+0000'))
+            lats = np.concatenate(
+                list(self.location('lat')) or [[]]
+            ).tolist()
+            longs = np.concatenate(
+                list(self.location('long')) or [[]]
+            ).tolist()
+
+        G = nx.Graph()
+        for i, node in enumerate(ids.tolist()):
+            attributes = {
+                'url': f"http://example.org/{names[codes[i]]}",
+                'date': dates[i],
+                'cluster': names[codes[i]],
+                'language': language.capitalize(),
+            }
+            if self.geo:
+                attributes.update({'lat': lats[i], 'long': longs[i]})
+            G.add_node(node, **attributes)
+        src = np.concatenate(list(self.endpoints('src')) or [[]]).astype(int)
+        dst = np.concatenate(list(self.endpoints('dst')) or [[]]).astype(int)
+        # An undirected graph merges the edges drawn twice
+        G.add_edges_from(zip(ids[src].tolist(), ids[dst].tolist()))
+
+        return G
+
+
+def write_networks(output, nodes, edges, n_clusters, start, end, seed,
+                   geo_share, pickle_limit, chunk):
+    """
+    Writes the retweet networks and geonetworks of every language to
+    output/new_graphs
+
+    Return: Network, the network of all languages
+    """
+
+    directory = os.path.join(output, 'new_graphs')
+    os.makedirs(directory, exist_ok=True)
+
+    networks = {}
+    for stream, (language, (suffix, share)) in enumerate(LANGUAGES.items()):
+        for kind, geo in (('network', False), ('geonetwork', True)):
+            scale = share * (geo_share if geo else 1)
+            network = Network(
+                round(nodes * scale), round(edges * scale), n_clusters,
+                start, end, seed, 2 * stream + geo, geo, chunk
+            )
+            path = os.path.join(directory, f"retweet_{kind}{suffix}.pickle")
+            # The pickle first, the .npz has to be newer to be read
+            if network.node_offsets[-1] <= pickle_limit:
+                import networkx as nx
+                nx.write_gpickle(network.to_graph(language), path)
+            network.write(arrays_path(path))
+            networks[language, kind] = network
+            print(f"{arrays_path(path)}: {network.node_offsets[-1]} nodes, "
+                  f"{network.edge_offsets[-1]} edges")
+
+    return networks['all', 'network']
+
+
+def conflicts(n_conflicts, start, end, seed):
+    """
+    Conflicts in the columns of conflict_data_ukr.csv the dashboard
+    reads, the first row holds the tags of the original
+
+    Return: pd.DataFrame
+    """
+
+    r = rng(seed, 100)
+    dates = pd.to_datetime(
+        r.integers(
+            pd.Timestamp(start).value // 10 ** 9,
+            pd.Timestamp(end).value // 10 ** 9,
+            n_conflicts
+        ), unit='s'
+    ).normalize()
+    names = np.array(['Ukraine: Donetsk', 'Ukraine: Luhansk'])
+    conflict_df = pd.DataFrame({
+        'id': np.arange(n_conflicts) + 100000,
+        'conflict_name': names[r.integers(len(names), size=n_conflicts)],
+        'latitude': r.uniform(47, 49, n_conflicts).round(6),
+        'longitude': r.uniform(37, 40, n_conflicts).round(6),
+        'country': 'Ukraine',
+        'date_start': dates.strftime('%Y-%m-%d'),
+        'date_end': (dates + pd.Timedelta(days=1)).strftime('%Y-%m-%d'),
+        'deaths_civilians': r.poisson(0.5, n_conflicts),
+        'best': r.poisson(3, n_conflicts),
+    })
+    tags = pd.DataFrame([{
+        'latitude': '#geo+lat', 'longitude': '#geo+lon',
+        'country': '#country+name', 'date_start': '#date+start',
+        'date_end': '#date+end', 'best': '#affected+killed',
+    }], columns=conflict_df.columns)
+
+    return pd.concat([tags, conflict_df], ignore_index=True)
+
+
+def frequencies(network, conflict_df, start, end):
+    """
+    Tweets per day of every cluster, their sum and the conflicts, in
+    the columns of tweet-conflict_frequencies.csv
+
+    Return: pd.DataFrame
+    """
+
+    first_day = np.datetime64(pd.Timestamp(start).date(), 'D')
+    days = pd.date_range(start, end, freq='D')
+    frequencies_df = pd.DataFrame(
+        network.daily_counts(first_day, len(days)),
+        columns=network.names
+    )
+    frequencies_df.insert(0, 'date', days.strftime('%Y-%m-%d'))
+
+    conflict_days = pd.to_datetime(conflict_df['date_start'][1:])
+    counts = conflict_days.dt.normalize().value_counts()
+    frequencies_df.insert(
+        1, 'conflicts', counts.reindex(days, fill_value=0).values
+    )
+    frequencies_df['sum'] = frequencies_df[network.names].sum(axis=1)
+
+    return frequencies_df
+
+
+def pearson_r(frequencies_df, names):
+    """
+    Pearson r of the tweets of every cluster, and their sum, with the
+    conflicts, in the records of pearson_r.pickle
+
+    Return: list(dict)
+    """
+
+    scores = []
+    for c in [str(name) for name in names] + ['sum']:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            r = np.corrcoef(frequencies_df[c], frequencies_df['conflicts'])
+        scores.append({'Cluster': c, 'Pearson R': round(float(r[0, 1]), 3)})
+
+    return scores
+
+
+def similarity(names, n_articles, start, end, seed):
+    """
+    The similarity network of the articles (stored in a list, like the
+    original), the similarity dataframe and the cluster explanations
+
+    Return: nx.DiGraph, pd.DataFrame, list(dict)
+    """
+
+    import networkx as nx
+
+    # Python strings, NumPy ones show as np.str_(...) in the tooltips
+    names = [str(name) for name in names]
+    r = rng(seed, 200)
+    urls = [f"http://example.org/article/{i}" for i in range(n_articles)]
+    codes = r.integers(len(names), size=n_articles)
+    keywords = [
+        r.choice(KEYWORDS, 8, replace=False).tolist() for _ in names
+    ]
+    dates = pd.to_datetime(
+        r.integers(
+            pd.Timestamp(start).value // 10 ** 9,
+            pd.Timestamp(end).value // 10 ** 9,
+            n_articles
+        ), unit='s'
+    ).strftime('%d/%m/%Y')
+
+    G = nx.DiGraph()
+    for url, code, date in zip(urls, codes, dates):
+        G.add_node(
+            url, cluster=names[code].split()[-1],
+            unified_words=keywords[code], date=date
+        )
+    # Similar articles are in the same cluster
+    for i, code in enumerate(codes):
+        others = np.flatnonzero(codes == code)
+        others = others[others != i]
+        if len(others) and r.random() < 0.7:
+            G.add_edge(
+                urls[i], urls[r.choice(others)],
+                score=float(r.uniform(0.5, 0.9)),
+                common_keywords_count=int(r.integers(1, 6))
+            )
+
+    similarity_df = pd.DataFrame({
+        'Publication (original)': urls,
+        'Title': [f"Article {i}" for i in range(n_articles)],
+        'Language': r.choice(['English', 'Russian'], n_articles),
+        'Keywords': [keywords[code] for code in codes],
+        'score': r.uniform(0.5, 0.9, n_articles).round(3),
+    })
+
+    cluster_explain = [{
+        'cluster': name,
+        'keywords': keywords[code],
+        'average_sim': float(r.uniform(0.5, 0.8)),
+        'links': [urls[i] for i in np.flatnonzero(codes == code)[:6]],
+    } for code, name in enumerate(names)]
+
+    return G, similarity_df, cluster_explain
+
+
+def generate(output, nodes, edges, n_clusters, start, end, seed=0,
+             geo_share=0.6, n_articles=400, n_conflicts=1000,
+             pickle_limit=100000, chunk=1000000):
+    """
+    Writes a complete synthetic dataset to output/new_graphs and
+    output/data
+    """
+
+    network = write_networks(
+        output, nodes, edges, n_clusters, start, end, seed, geo_share,
+        pickle_limit, chunk
+    )
+
+    data_directory = os.path.join(output, 'data')
+    graphs_directory = os.path.join(output, 'new_graphs')
+    os.makedirs(data_directory, exist_ok=True)
+
+    conflict_df = conflicts(n_conflicts, start, end, seed)
+    conflict_df.to_csv(
+        os.path.join(data_directory, 'conflict_data_ukr.csv'), index=False
+    )
+
+    frequencies_df = frequencies(network, conflict_df, start, end)
+    frequencies_df.to_csv(
+        os.path.join(graphs_directory, 'tweet-conflict_frequencies.csv'),
+        index=False
+    )
+    with open(os.path.join(graphs_directory, 'pearson_r.pickle'), 'wb') as f:
+        pickle.dump(pearson_r(frequencies_df, network.names), f)
+
+    G, similarity_df, cluster_explain = similarity(
+        network.names, n_articles, start, end, seed
+    )
+    for name, value in (
+        ('similarity_network.pickle', [G]),
+        ('similarity_df.pickle', similarity_df),
+        ('cluster_explain.pickle', cluster_explain),
+    ):
+        with open(os.path.join(data_directory, name), 'wb') as f:
+            pickle.dump(value, f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--output', default='synthetic')
+    parser.add_argument('--nodes', type=int, default=100000)
+    parser.add_argument('--edges', type=int, default=500000)
+    parser.add_argument('--clusters', type=int, default=60)
+    parser.add_argument('--start', default='2016-01-01')
+    parser.add_argument('--end', default='2017-06-30')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--geo-share', type=float, default=0.6,
+        help="share of the tweets with a location"
+    )
+    parser.add_argument('--articles', type=int, default=400)
+    parser.add_argument('--conflicts', type=int, default=1000)
+    parser.add_argument(
+        '--pickle-limit', type=int, default=100000,
+        help="largest network also written as a networkx pickle"
+    )
+    parser.add_argument(
+        '--chunk', type=int, default=1000000,
+        help="nodes or edges generated at once"
+    )
+    options = parser.parse_args()
+
+    generate(
+        options.output, options.nodes, options.edges, options.clusters,
+        options.start, options.end, options.seed, options.geo_share,
+        options.articles, options.conflicts, options.pickle_limit,
+        options.chunk
+    )
@@ -0,0 +1,327 @@
+"""
+Columnar format for the retweet (geo)networks.
+
+The dashboard only reads the date, cluster and location of the nodes
+and the endpoints of the edges. Instead of unpickling a networkx graph
+these are stored as flat NumPy arrays in a .npz next to the pickle:
+
+    node_id         str      id of the tweet
+    cluster         int16    code into cluster_names
+    cluster_names   str      sorted cluster names
+    node_offsets    int64    nodes of code c are node_offsets[c]:[c+1]
+    date            datetime64[ms]
+    lat, long       float64  (geonetworks only)
+    src, dst        int32    node positions of the edge endpoints
+    edge_offsets    int64    edges of code c are edge_offsets[c]:[c+1]
+    version         int      FORMAT_VERSION the file was written with
+
+Nodes are sorted by cluster and date, edges by cluster, so selecting
+clusters is a couple of slices and a date window within a cluster a
+binary search. Run this file to (re)build every .npz.
+"""
+
+import os
+import uuid
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+NODE_FIELDS = ('lat', 'long')
+TWITTER_DATE_FORMAT = '%a %b %d %H:%M:%S %z %Y'
+
+# Bump when the layout of the arrays changes, older files are rebuilt
+FORMAT_VERSION = 2
+
+
+def graph_to_arrays(G):
+    """
+    Converts a retweet (geo)network to columnar arrays
+
+    Return: dict(np.ndarray)
+    """
+
+    node_id = np.array(list(G.nodes()), dtype=str)
+    cluster = [c for _, c in G.nodes(data='cluster')]
+    cluster_names = np.array(sorted(set(cluster)), dtype=str)
+    codes = np.searchsorted(cluster_names, cluster).astype(np.int16)
+
+    # Geonetworks store dates as twitter strings, retweet networks as
+    # timestamps, both become naive UTC datetimes
+    dates = [d for _, d in G.nodes(data='date')]
+    date_format = TWITTER_DATE_FORMAT if isinstance(dates[0], str) else None
+    dates = pd.to_datetime(
+        dates, format=date_format, utc=True
+    ).tz_localize(None).values.astype('datetime64[ms]')
+
+    fields = {}
+    for field in NODE_FIELDS:
+        values = [v for _, v in G.nodes(data=field)]
+        if any(v is not None for v in values):
+            fields[field] = np.array(values, dtype=np.float64)
+
+    # Edges by position of their nodes
+    position = {node: i for i, node in enumerate(G.nodes())}
+    edges = np.array(
+        [(position[start], position[end]) for start, end in G.edges()],
+        dtype=np.int32
+    ).reshape(-1, 2)
+
+    return sort_arrays(node_id, codes, cluster_names, dates, edges, fields)
+
+
+def sort_arrays(node_id, codes, cluster_names, dates, edges, fields=None):
+    """
+    Columnar arrays of unsorted nodes and edges (n x 2 node positions):
+    nodes sorted by cluster and date, edges by cluster of the source,
+    with the offsets of every cluster
+
+    Return: dict(np.ndarray)
+    """
+
+    # Sort nodes by cluster, and by date inside a cluster
+    order = np.lexsort((dates, codes))
+    arrays = {
+        'node_id': node_id[order],
+        'cluster': codes[order],
+        'cluster_names': cluster_names,
+        'node_offsets': np.searchsorted(
+            codes[order], np.arange(len(cluster_names) + 1)
+        ),
+        'date': dates[order],
+    }
+    for field, values in (fields or {}).items():
+        arrays[field] = values[order]
+
+    # Edge endpoints to the sorted positions
+    position = np.empty(len(order), dtype=np.int32)
+    position[order] = np.arange(len(order), dtype=np.int32)
+    src, dst = position[edges[:, 0]], position[edges[:, 1]]
+
+    edge_codes = arrays['cluster'][src]
+    edge_order = np.argsort(edge_codes, kind='stable')
+    arrays['src'] = src[edge_order]
+    arrays['dst'] = dst[edge_order]
+    arrays['edge_offsets'] = np.searchsorted(
+        edge_codes[edge_order], np.arange(len(cluster_names) + 1)
+    )
+    arrays['version'] = np.array(FORMAT_VERSION)
+
+    return arrays
+
+
+def arrays_path(pickle_path):
+    """
+    Path of the columnar file belonging to a pickled graph
+
+    Return: str
+    """
+
+    return os.path.splitext(pickle_path)[0] + '.npz'
+
+
+def convert_graph(pickle_path):
+    """
+    Converts a pickled graph to its .npz file.
+    When the directory is read-only the arrays are only returned.
+
+    Return: dict(np.ndarray)
+    """
+
+    import networkx as nx
+
+    arrays = graph_to_arrays(nx.read_gpickle(pickle_path))
+    # Write to a temporary file first, other workers may be reading it
+    # or converting it too
+    path = arrays_path(pickle_path)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+    return arrays
+
+
+def read_arrays(pickle_path):
+    """
+    Reads the columnar arrays of a pickled graph, converting the pickle
+    first when the .npz is missing, older than the pickle or can not be
+    read.
+
+    Return: dict(np.ndarray)
+    """
+
+    path = arrays_path(pickle_path)
+    stale = (
+        not os.path.exists(path)
+        or (os.path.exists(pickle_path)
+            and os.path.getmtime(path) < os.path.getmtime(pickle_path))
+    )
+    if stale:
+        return convert_graph(pickle_path)
+
+    try:
+        with np.load(path) as npz:
+            arrays = {key: npz[key] for key in npz.files}
+    except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+        return convert_graph(pickle_path)
+    if arrays.get('version') != FORMAT_VERSION:
+        return convert_graph(pickle_path)
+
+    return arrays
+
+
+def cluster_codes(arrays, clusters):
+    """
+    Codes of the cluster names, unknown clusters are skipped
+
+    Return: np.ndarray
+    """
+
+    names = arrays['cluster_names']
+    clusters = np.asarray(list(clusters), dtype=str)
+    codes = np.searchsorted(names, clusters)
+    codes = np.minimum(codes, len(names) - 1)
+    return codes[names[codes] == clusters]
+
+
+def cluster_slices(arrays, clusters, offsets='node_offsets'):
+    """
+    Slice of the nodes of every cluster, or of the edges with
+    offsets='edge_offsets'. Unknown clusters get an empty slice.
+
+    Return: dict(slice)
+    """
+
+    names = arrays['cluster_names']
+    offsets = arrays[offsets]
+    clusters = list(clusters)
+    codes = np.searchsorted(names, np.asarray(clusters, dtype=str))
+
+    slices = {}
+    for c, code in zip(clusters, codes):
+        if code < len(names) and names[code] == c:
+            slices[c] = slice(offsets[code], offsets[code + 1])
+        else:
+            slices[c] = slice(0, 0)
+
+    return slices
+
+
+def edge_segments(values, src, dst, gap):
+    """
+    Line segments for plotly: values[src], values[dst], gap for every
+    edge, the gap (NaN / NaT) breaks the line between edges.
+
+    Return: np.ndarray
+    """
+
+    segments = np.empty(3 * len(src), dtype=values.dtype)
+    segments[0::3] = values[src]
+    segments[1::3] = values[dst]
+    segments[2::3] = gap
+
+    return segments
+
+
+def select_clusters(arrays, clusters, start=None, end=None):
+    """
+    Nodes and edges of every cluster with a date within [start, end]
+    (dates, both optional and inclusive). Nodes are a slice of the
+    arrays, found with a binary search, edges an array of positions.
+    Only touches the nodes and edges of the selected clusters.
+
+    Return: dict(cluster -> (slice, np.ndarray))
+    """
+
+    node_slices = cluster_slices(arrays, clusters)
+    edge_slices = cluster_slices(arrays, clusters, offsets='edge_offsets')
+
+    selection = {}
+    for c, nodes in node_slices.items():
+        edges = np.arange(edge_slices[c].start, edge_slices[c].stop)
+
+        if start is not None or end is not None:
+            dates = arrays['date'][nodes]
+            low, high = 0, len(dates)
+            if start is not None:
+                low = np.searchsorted(dates, to_datetime64(start), 'left')
+            if end is not None:
+                # The whole end day is in the window
+                high = np.searchsorted(
+                    dates, to_datetime64(end) + np.timedelta64(1, 'D'), 'left'
+                )
+            nodes = slice(nodes.start + low, nodes.start + max(low, high))
+
+            src, dst = arrays['src'][edges], arrays['dst'][edges]
+            edges = edges[
+                (src >= nodes.start) & (src < nodes.stop)
+                & (dst >= nodes.start) & (dst < nodes.stop)
+            ]
+
+        selection[c] = (nodes, edges)
+
+    return selection
+
+
+def selected_nodes(selection):
+    """
+    Positions of all nodes of select_clusters
+
+    Return: np.ndarray
+    """
+
+    nodes = [np.arange(s.start, s.stop) for s, _ in selection.values()]
+    return np.concatenate(nodes) if nodes else np.empty(0, dtype=np.int64)
+
+
+def selected_edges(selection):
+    """
+    Positions of all edges of select_clusters
+
+    Return: np.ndarray
+    """
+
+    edges = [e for _, e in selection.values()]
+    return np.concatenate(edges) if edges else np.empty(0, dtype=np.int64)
+
+
+def selection_points(selection):
+    """
+    Number of nodes and edges of select_clusters, slices or positions
+
+    Return: int
+    """
+
+    return sum(
+        len(range(nodes.start, nodes.stop)) if isinstance(nodes, slice)
+        else len(nodes)
+        for nodes, _ in selection.values()
+    ) + sum(len(edges) for _, edges in selection.values())
+
+
+def to_datetime64(date):
+    """
+    A date (string, datetime or np.datetime64) in the unit of 'date'
+
+    Return: np.datetime64
+    """
+
+    return np.datetime64(pd.Timestamp(date).to_datetime64(), 'ms')
+
+
+if __name__ == '__main__':
+    from data import RETWEET_NETWORKS, RETWEET_GEONETWORKS
+
+    for pickle_path in [
+        *RETWEET_NETWORKS.values(), *RETWEET_GEONETWORKS.values()
+    ]:
+        arrays = convert_graph(pickle_path)
+        print(f"{arrays_path(pickle_path)}: {len(arrays['node_id'])} nodes, "
+              f"{len(arrays['src'])} edges")
@@ -0,0 +1,275 @@
+"""
+Latency and size metrics of the dashboard, in the Prometheus text format
+on the /metrics route of the Flask server.
+
+Every Dash callback request is timed (wall and CPU time of the request
+thread) and its response size recorded, labelled with the outputs of the
+callback. Every figure built by figures.build_figures or figures.call
+is timed per function and the size of its serialized result recorded,
+and the figure cache counts hits and misses.
+
+Recording is a lock and a bisect per observation. With FIGURE_POOL set
+to 'process' the figure cache runs in the workers, its metrics are not
+collected.
+
+Every process (gunicorn worker) keeps its own metrics, every series is
+labelled with the pid of its worker. A scrape is answered by one worker:
+with METRICS_DIR set, every worker writes its metrics there after each
+callback request, and /metrics returns those of all of them (the files
+of stopped workers too, their counts do not go back). Sum over the
+worker label to aggregate. Without it a scrape only sees the worker
+answering it.
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+
+from flask import Response, g, request
+
+import config
+
+SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTES = tuple(1024 * 4 ** i for i in range(10))
+
+# Every metric, in the order they are exposed
+METRICS = []
+
+
+class Histogram:
+    """
+    Prometheus histogram per label value
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, label, buckets):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        # label value -> [bucket counts..., sum]
+        self.values = {}
+        self.lock = threading.Lock()
+        METRICS.append(self)
+
+    def observe(self, label, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(label)
+            if counts is None:
+                counts = self.values[label] = [0] * (len(self.buckets) + 2)
+            counts[i] += 1
+            counts[-1] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {label: list(c) for label, c in self.values.items()}
+
+    def samples(self, snapshots):
+        for worker, values in snapshots.items():
+            for label, counts in sorted(values.items()):
+                labels = (
+                    f'{self.label}="{escape(label)}",worker="{worker}"'
+                )
+                total = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    total += count
+                    yield (f'{self.name}_bucket{{{labels},le="{bound}"}} '
+                           f'{total}')
+                yield f'{self.name}_sum{{{labels}}} {counts[-1]}'
+                yield f'{self.name}_count{{{labels}}} {total}'
+
+
+class Counter:
+    """
+    Prometheus counter per value of two labels
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+        METRICS.append(self)
+
+    def inc(self, *label_values):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(key), count] for key, count in self.values.items()]
+
+    def samples(self, snapshots):
+        for worker, values in snapshots.items():
+            for label_values, count in sorted(values):
+                labels = ','.join(
+                    f'{label}="{escape(value)}"'
+                    for label, value in zip(
+                        self.labels + ('worker',), label_values + [worker]
+                    )
+                )
+                yield f'{self.name}_total{{{labels}}} {count}'
+
+
+def escape(value):
+    """
+    A label value in the text format
+
+    Return: str
+    """
+
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n'
+    )
+
+
+CALLBACK_SECONDS = Histogram(
+    'dash_callback_seconds', "Wall time of Dash callback requests",
+    'callback', SECONDS
+)
+CALLBACK_CPU_SECONDS = Histogram(
+    'dash_callback_cpu_seconds',
+    "CPU time of the thread handling Dash callback requests",
+    'callback', SECONDS
+)
+CALLBACK_BYTES = Histogram(
+    'dash_callback_response_bytes', "Size of Dash callback responses",
+    'callback', BYTES
+)
+FIGURE_SECONDS = Histogram(
+    'figure_seconds', "Wall time of building a figure", 'function', SECONDS
+)
+FIGURE_CPU_SECONDS = Histogram(
+    'figure_cpu_seconds', "CPU time of building a figure",
+    'function', SECONDS
+)
+FIGURE_BYTES = Histogram(
+    'figure_bytes', "Size of serialized figures and other results",
+    'function', BYTES
+)
+FIGURE_CACHE = Counter(
+    'figure_cache_requests', "Lookups in the figure cache",
+    ('function', 'result')
+)
+
+
+def snapshot():
+    """
+    The values of every metric of this process, as JSON types
+
+    Return: dict(name -> object)
+    """
+
+    return {metric.name: metric.snapshot() for metric in METRICS}
+
+
+def save(directory=None):
+    """
+    Writes the metrics of this process to directory (METRICS_DIR), for
+    the workers answering /metrics
+    """
+
+    directory = directory or config.METRICS_DIR
+    if not directory:
+        return
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    # Write to a temporary file first, other workers may be reading it
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(snapshot(), f)
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+def snapshots(directory=None):
+    """
+    The metrics of every worker: those saved in directory (METRICS_DIR)
+    and the current ones of this process
+
+    Return: dict(worker -> dict(name -> object))
+    """
+
+    directory = directory or config.METRICS_DIR
+    workers = {}
+    if directory and os.path.isdir(directory):
+        for entry in os.scandir(directory):
+            if entry.name.endswith('.json'):
+                try:
+                    with open(entry.path, encoding='utf-8') as f:
+                        workers[entry.name[:-len('.json')]] = json.load(f)
+                except (OSError, ValueError):
+                    pass
+    workers[str(os.getpid())] = snapshot()
+
+    return dict(sorted(workers.items()))
+
+
+def render():
+    """
+    Every metric of every worker in the Prometheus text format
+
+    Return: str
+    """
+
+    workers = snapshots()
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples({
+            worker: values[metric.name]
+            for worker, values in workers.items() if metric.name in values
+        }))
+    return '\n'.join(lines) + '\n'
+
+
+def instrument(server, path='/_dash-update-component'):
+    """
+    Times the Dash callback requests of the Flask server and adds the
+    /metrics route. With METRICS_DIR the metrics of the worker are saved
+    after every callback request.
+    """
+
+    if not config.METRICS:
+        return
+
+    @server.before_request
+    def start_timer():
+        if request.path.endswith(path):
+            g.metrics_start = (time.perf_counter(), time.thread_time())
+
+    @server.after_request
+    def record(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            body = request.get_json(silent=True) or {}
+            callback = body.get('output', 'unknown')
+            CALLBACK_SECONDS.observe(callback, time.perf_counter() - start[0])
+            CALLBACK_CPU_SECONDS.observe(
+                callback, time.thread_time() - start[1]
+            )
+            if not response.direct_passthrough:
+                CALLBACK_BYTES.observe(
+                    callback, response.calculate_content_length() or 0
+                )
+            save()
+        return response
+
+    @server.route('/metrics')
+    def metrics():
+        return Response(render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,229 @@
+"""
+Density images of large graphs, rasterized on the server in the style of
+Datashader. Nodes and the lines of the edges are counted per pixel and
+per cluster, every pixel gets the mix of the colors of its clusters
+weighted by their counts, and is more opaque the more it counts (log
+scaled). The browser only gets the PNG, whatever the number of edges,
+and the server samples at most about SAMPLES points along the lines.
+
+Images are sent as data URIs in a layout image of the figure, behind a
+sparse interactive overlay. Written with NumPy and zlib only.
+"""
+
+import base64
+import struct
+import zlib
+
+import numpy as np
+
+# Samples drawn along the lines of an image, about a second of work.
+# Lines are sampled at every pixel when that fits, else evenly with
+# every sample counting for more pixels, but at least LINE_SAMPLES times.
+SAMPLES = 2 ** 25
+LINE_SAMPLES = 16
+# Samples counted at once
+CHUNK = 2 ** 22
+
+
+def numeric(values):
+    """
+    Numbers of values, dates as ms since the epoch
+
+    Return: np.ndarray
+    """
+
+    values = np.asarray(values)
+    if values.dtype.kind == 'M':
+        values = values.astype('datetime64[ms]').astype(np.int64)
+    return values.astype(np.float64)
+
+
+def pixels(values, low, high, size):
+    """
+    Pixel coordinates of values on an axis from low to high of size
+    pixels, as floats
+
+    Return: np.ndarray
+    """
+
+    return (np.asarray(values, dtype=np.float64) - low) * (size / (high - low))
+
+
+def flat_pixels(columns, rows, codes, shape):
+    """
+    Positions of the pixels [code, row, column] in the flattened counts
+    of shape, the size of the counts (an extra bin) for points out of
+    bounds, all integer arrays
+
+    Return: np.ndarray
+    """
+
+    n, height, width = shape
+    inside = (
+        (columns >= 0) & (columns < width) & (rows >= 0) & (rows < height)
+    )
+    flat = codes * (height * width) + rows * width + columns
+    # An extra bin is cheaper than selecting the points inside
+    return np.where(inside, flat, n * height * width)
+
+
+def add_counts(counts, flat, weights=None):
+    """
+    Adds 1 (or the weight) to counts at every position of flat_pixels
+    """
+
+    counts += np.bincount(
+        flat, weights, minlength=counts.size + 1
+    )[:-1].reshape(counts.shape)
+
+
+def count_lines(x0, y0, x1, y1, codes, counts):
+    """
+    Adds the pixels crossed by every line (x0, y0) - (x1, y1), in pixel
+    coordinates, to counts[code]. Lines are sampled at every pixel along
+    their longest side, or fewer times when there are many, see SAMPLES.
+    """
+
+    valid = (
+        np.isfinite(x0) & np.isfinite(y0) & np.isfinite(x1) & np.isfinite(y1)
+    )
+    length = np.maximum(np.abs(x1 - x0), np.abs(y1 - y0))[valid]
+    most = max(LINE_SAMPLES, SAMPLES // max(len(length), 1))
+    steps = np.minimum(np.ceil(length), most).astype(np.int64) + 1
+
+    # Longest lines first, the lines with a k-th sample are a prefix
+    order = np.argsort(-steps, kind='stable')
+    steps = steps[order]
+    # Single precision is exact enough within an image
+    x0, y0, x1, y1 = (
+        a[valid][order].astype(np.float32) for a in (x0, y0, x1, y1)
+    )
+    codes = codes[valid][order].astype(np.int32)
+    dx, dy = x1 - x0, y1 - y0
+    weights = np.maximum(length[order], 1) / steps
+    fraction = (1 / np.maximum(steps - 1, 1)).astype(np.float32)
+
+    # Samples are counted in batches of about CHUNK
+    batch, batch_weights, size = [], [], 0
+    for k in range(steps[0] if len(steps) else 0):
+        n = np.searchsorted(-steps, -k, 'left')
+        t = np.float32(k) * fraction[:n]
+        batch.append(flat_pixels(
+            np.floor(x0[:n] + t * dx[:n]).astype(np.int32),
+            np.floor(y0[:n] + t * dy[:n]).astype(np.int32),
+            codes[:n], counts.shape
+        ))
+        batch_weights.append(weights[:n])
+        size += n
+        if size >= CHUNK or k == steps[0] - 1:
+            add_counts(
+                counts, np.concatenate(batch), np.concatenate(batch_weights)
+            )
+            batch, batch_weights, size = [], [], 0
+
+
+def shade(counts, colors, min_alpha=0.3):
+    """
+    RGBA image of the counts per cluster, the colors ('#rrggbb') of the
+    clusters mixed by their counts, and the opacity the log of the total
+    count. The first row of counts is the bottom of the image.
+
+    Return: np.ndarray (height, width, 4) uint8
+    """
+
+    rgb = np.array([
+        [int(c[i:i + 2], 16) for i in (1, 3, 5)] for c in colors
+    ], dtype=np.float64).reshape(-1, 3)
+
+    total = counts.sum(axis=0)
+    filled = total > 0
+    mixed = np.einsum('chw,ck->hwk', counts, rgb)
+    mixed[filled] /= total[filled][:, None]
+
+    alpha = np.zeros(total.shape)
+    if filled.any():
+        alpha[filled] = min_alpha + (1 - min_alpha) * (
+            np.log1p(total[filled]) / np.log1p(total.max())
+        )
+
+    image = np.dstack([mixed, 255 * alpha])
+    return np.round(image[::-1]).astype(np.uint8)
+
+
+def png(image):
+    """
+    PNG of an RGBA image
+
+    Return: bytes
+    """
+
+    height, width, _ = image.shape
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    # Every row starts with its filter type, 0 (none)
+    rows = np.hstack([
+        np.zeros((height, 1), dtype=np.uint8), image.reshape(height, -1)
+    ])
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)),
+        chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)),
+        chunk(b'IEND', b''),
+    ])
+
+
+def rasterize(x, y, codes, src, dst, extent, size, colors):
+    """
+    Density image of a graph: nodes at (x, y) of cluster codes, the
+    edges from src to dst (positions of the nodes) of the cluster of
+    src. extent is (x0, x1, y0, y1) in the units of x and y, size
+    (width, height) in pixels and colors one per code.
+
+    Return: np.ndarray (height, width, 4) uint8
+    """
+
+    x0, x1, y0, y1 = extent
+    width, height = size
+    columns = pixels(x, x0, x1, width)
+    rows = pixels(y, y0, y1, height)
+
+    counts = np.zeros((len(colors), height, width), dtype=np.float32)
+    count_lines(
+        columns[src], rows[src], columns[dst], rows[dst], codes[src], counts
+    )
+    add_counts(counts, flat_pixels(
+        np.floor(columns).astype(np.int64), np.floor(rows).astype(np.int64),
+        codes.astype(np.int64), counts.shape
+    ))
+
+    return shade(counts, colors)
+
+
+def layout_image(image, extent, **kwargs):
+    """
+    Layout image of a plotly figure showing image over extent (x0, x1,
+    y0, y1) in the units of the axes, dates as np.datetime64
+
+    Return: dict()
+    """
+
+    x0, x1, y0, y1 = extent
+    if isinstance(x0, np.datetime64):
+        # Date axes take the size in milliseconds
+        sizex = float((x1 - x0) / np.timedelta64(1, 'ms'))
+        x0 = str(x0)
+    else:
+        sizex = x1 - x0
+
+    return dict(
+        source='data:image/png;base64,'
+               + base64.b64encode(png(image)).decode('ascii'),
+        xref='x', yref='y',
+        x=x0, y=y1, sizex=sizex, sizey=y1 - y0,
+        xanchor='left', yanchor='top',
+        sizing='stretch', layer='below',
+        **kwargs
+    )
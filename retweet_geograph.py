@@ -1,92 +1,185 @@
-import networkx as nx
+import numpy as np
 import plotly.graph_objects as go
 
+import config
+import encoding
+from data import load_retweet_geonetwork
+from figure_cache import cached_figure
+from figures import patch_clusters
+from graph_arrays import (
+    edge_segments, select_clusters, selected_nodes, selection_points
+)
+from retweet_graph import (
+    COLORWAY, component_bounds, downsample, raster_layer
+)
 
-def filter_to_clusters(G, clusters):
+
+# Line widths of the flows, the i-th for flows of 10**i retweets or more
+FLOW_WIDTHS = (1, 2, 4, 8)
+
+
+def edge_groups():
     """
-    Filters the nodes of G based on attribute 'cluster'
+    Number of edge traces of a cluster, one per line width of the flows
+    with config.GEO_FLOWS
 
-    Return: nx.Graph()
+    Return: int
     """
 
-    remove_nodes_cluster = []
-    for node in G.nodes():
-        if G.nodes[node]['cluster'] not in set(clusters):
-            remove_nodes_cluster.append(node)
+    return len(FLOW_WIDTHS) if config.GEO_FLOWS else 1
+
+
+def geo_scatters(G, clusters, start=None, end=None, slots=None):
+    """
+    Set the scatter plot for retweets with nodes and edges, of the
+    tweets within the dates [start, end]. Every cluster gets its edge
+    traces (see edge_groups) and a node trace, empty ones too, in the
+    color of its slot (see retweet_graph.component_bounds). Edge traces
+    are grouped by width, one per cluster in every group.
 
-    for node in remove_nodes_cluster:
-        G.remove_node(node)
+    Return: list(go.Scattergeo()), list(go.Scattergeo())
+    """
 
-    return G
+    # nodes of a cluster are one slice of the arrays
+    selection = select_clusters(G, clusters, start, end)
+    comps_bounds = component_bounds(clusters, slots)
 
+    node_trace = []
+    edge_trace = [[] for _ in range(edge_groups())]
+    for c in clusters:
+        *edges, node = cluster_geoscatter(
+            G, *selection[c], c, comps_bounds[c]['color']
+        )
+        for group, edge in zip(edge_trace, edges):
+            group.append(edge)
+        node_trace.append(node)
 
-def geo_scatters(G, clusters):
+    return [edge for group in edge_trace for edge in group], node_trace
+
+
+def aggregate_flows(lon, lat, src, dst, decimals):
     """
-    Set the scatter plot for retweets with nodes and edges
+    Origin-destination flows of the edges src -> dst between places, the
+    locations (lon, lat) of the nodes rounded to decimals. A flow counts
+    its edges and goes from the mean location of the edge ends in its
+    origin to that in its destination. Edges without a location, or
+    within a place, draw no line and are left out.
 
-    Return: go.Scatter(), go.Scatter()
+    Return: np.ndarray (lon0), np.ndarray (lat0), np.ndarray (lon1),
+            np.ndarray (lat1), np.ndarray (count)
     """
 
-    # add edges
-    edge_lon = {c: [] for c in clusters}
-    edge_lat = {c: [] for c in clusters}
+    located = (
+        np.isfinite(lon[src]) & np.isfinite(lat[src])
+        & np.isfinite(lon[dst]) & np.isfinite(lat[dst])
+    )
+    ends = np.concatenate([src[located], dst[located]])
+    # Places as one integer, sorting it is much faster than sorting rows
+    scale = 10.0 ** decimals
+    x = np.round(lon[ends] * scale).astype(np.int64)
+    y = np.round(lat[ends] * scale).astype(np.int64)
+    if len(ends):
+        x -= x.min()
+        y -= y.min()
+    _, place = np.unique(x * (y.max(initial=0) + 1) + y, return_inverse=True)
+    place = place.reshape(-1)
+    n = int(place.max()) + 1 if len(place) else 0
+    ends_per_place = np.bincount(place, minlength=n)
+    place_lon = np.bincount(place, lon[ends], n) / ends_per_place
+    place_lat = np.bincount(place, lat[ends], n) / ends_per_place
 
-    for start, end in G.edges():
-        c = G.nodes[start]['cluster']
-        edge_lat[c].append(G.nodes[start]['lat'])
-        edge_lat[c].append(G.nodes[end]['lat'])
-        edge_lat[c].append(None)
+    origin, destination = np.split(place, 2)
+    between = origin != destination
+    flow, count = np.unique(
+        origin[between] * n + destination[between], return_counts=True
+    )
+    origin, destination = flow // n, flow % n
 
-        edge_lon[c].append(G.nodes[start]['long'])
-        edge_lon[c].append(G.nodes[end]['long'])
-        edge_lon[c].append(None)
+    return (
+        place_lon[origin], place_lat[origin],
+        place_lon[destination], place_lat[destination], count
+    )
 
-    # add nodes
-    node_lon = {c: [] for c in clusters}
-    node_lat = {c: [] for c in clusters}
 
-    for node in G.nodes():
-        c = G.nodes[node]['cluster']
-        node_lon[c].append(G.nodes[node]['long'])
-        node_lat[c].append(G.nodes[node]['lat'])
+def flow_scatters(G, edges, name, color):
+    """
+    The edge traces of one cluster with config.GEO_FLOWS: its flows (see
+    aggregate_flows) by width, a trace per FLOW_WIDTHS, empty ones too.
+    Hovering a line shows its number of retweets.
 
-    # find cluster without nodes
-    empty_clusters = [name for name, c in node_lon.items() if c == []]
+    Return: list(go.Scattergeo())
+    """
 
-    # remove empty clusters
-    for c in empty_clusters:
-        node_lon.pop(c), node_lat.pop(c), clusters.remove(c)
+    lon0, lat0, lon1, lat1, count = aggregate_flows(
+        G['long'], G['lat'], G['src'][edges], G['dst'][edges],
+        config.GEO_FLOW_DECIMALS
+    )
+    width = np.minimum(
+        np.floor(np.log10(count)).astype(np.int64), len(FLOW_WIDTHS) - 1
+    )
 
-    node_trace = []
-    edge_trace = []
-    for c in clusters:
-        node_trace.append(go.Scattergeo(
-            name=c,
-            lon=node_lon[c],
-            lat=node_lat[c],
-            hoverinfo='text',
-            # text = retweets['node_user_descrip'],
-            mode='markers',
-            marker=dict(
-                size=3,
-                # color='rgb(255, 0, 0)',
-                line=dict(
-                    width=1,
-                    # color='rgba(68, 68, 68, 0)'
-                )
-            )
-        ))
+    def segments(start, end, values):
+        return np.column_stack([
+            start[values], end[values], np.full(values.sum(), np.nan)
+        ]).ravel().astype(np.float32)
 
-        edge_trace.append(go.Scattergeo(
-            name=c,
-            locationmode='ISO-3',
-            lon=edge_lon[c],
-            lat=edge_lat[c],
+    traces = []
+    for i, line_width in enumerate(FLOW_WIDTHS):
+        flows = width == i
+        traces.append(go.Scattergeo(
+            name=name,
+            lon=segments(lon0, lon1, flows),
+            lat=segments(lat0, lat1, flows),
+            customdata=segments(count, count, flows),
+            hovertemplate='%{customdata} retweets',
             mode='lines',
-            line=dict(width=1),  # color='red'),
+            line=dict(width=line_width, color=color),
             opacity=0.5
         ))
 
+    return traces
+
+
+def cluster_geoscatter(G, nodes, edges, name, color):
+    """
+    The edge traces (see edge_groups) and the node trace of one cluster
+
+    Return: tuple(go.Scattergeo())
+    """
+
+    # Single precision locations are within a metre, and halve the figure
+    node_trace = go.Scattergeo(
+        name=name,
+        lon=G['long'][nodes].astype(np.float32),
+        lat=G['lat'][nodes].astype(np.float32),
+        hoverinfo='text',
+        # text = retweets['node_user_descrip'],
+        mode='markers',
+        marker=dict(
+            size=3,
+            color=color,
+            line=dict(
+                width=1,
+                # color='rgba(68, 68, 68, 0)'
+            )
+        )
+    )
+
+    if config.GEO_FLOWS:
+        return (*flow_scatters(G, edges, name, color), node_trace)
+
+    src = G['src'][edges]
+    dst = G['dst'][edges]
+    edge_trace = go.Scattergeo(
+        name=name,
+        locationmode='ISO-3',
+        lon=edge_segments(G['long'], src, dst, np.nan).astype(np.float32),
+        lat=edge_segments(G['lat'], src, dst, np.nan).astype(np.float32),
+        mode='lines',
+        line=dict(width=1, color=color),
+        opacity=0.5
+    )
+
     return edge_trace, node_trace
 
 
@@ -101,8 +194,7 @@ def build_geoplot(edge_trace, node_trace):
         layout=go.Layout(
             title_text='Geolocation of Tweets',
             showlegend=False,
-            colorway=['#5E0DAC', '#FF4F00', '#375CB1',
-                      '#FF7400', '#FFF400', '#FF0056'],
+            colorway=COLORWAY,
             template='plotly_dark',
             paper_bgcolor='rgba(0, 0, 0, 0)',
             plot_bgcolor='rgba(0, 0, 0, 0)',
@@ -121,34 +213,118 @@ def build_geoplot(edge_trace, node_trace):
     return fig
 
 
-def run_retweet_geograph(language, cluster=None):
-    # Import retweet graph
-    if language == 'all':
-        # Import all retweets
-        G = nx.read_gpickle('new_graphs/retweet_geonetwork.pickle')
-    elif language == 'english':
-        # Import only tweets with english articles
-        G = nx.read_gpickle(
-            'new_graphs/retweet_geonetwork_english.pickle'
+def build_georaster(G, selection, clusters, slots=None):
+    """
+    Build the density plot of all nodes and edges of the selection, on
+    longitude and latitude axes (a projection can not hold an image),
+    with a sample of the nodes as markers on top.
+
+    Return: fig
+    """
+
+    colors = {
+        c: bounds['color']
+        for c, bounds in component_bounds(clusters, slots).items()
+    }
+
+    # Bounds of the nodes, a little wider
+    nodes = selected_nodes(selection)
+    lon, lat = G['long'][nodes], G['lat'][nodes]
+    x0, x1 = np.nanmin(lon) - 1, np.nanmax(lon) + 1
+    y0, y1 = np.nanmin(lat) - 1, np.nanmax(lat) + 1
+    image = raster_layer(
+        G, selection, G['long'], G['lat'], colors, (x0, x1, y0, y1)
+    )
+
+    markers = {c: (n, e[:0]) for c, (n, e) in selection.items()}
+    drawn, fraction = downsample(G, markers, config.RASTER_OVERLAY_POINTS)
+    node_trace = [
+        go.Scattergl(
+            name=c,
+            x=G['long'][nodes].astype(np.float32),
+            y=G['lat'][nodes].astype(np.float32),
+            mode='markers',
+            marker=dict(size=3, color=colors[c]),
         )
-    elif language == 'russian':
-        # Import only tweets with russian articles
-        G = nx.read_gpickle(
-            'new_graphs/retweet_geonetwork_russian.pickle'
+        for c, (nodes, _) in drawn.items()
+    ]
+
+    fig = go.Figure(
+        data=node_trace,
+        layout=go.Layout(
+            title_text='Geolocation of Tweets',
+            showlegend=False,
+            template='plotly_dark',
+            paper_bgcolor='rgba(0, 0, 0, 0)',
+            plot_bgcolor='rgba(0, 0, 0, 0)',
+            xaxis=dict(title='Longitude', range=[x0, x1], showgrid=False),
+            yaxis=dict(
+                title='Latitude', range=[y0, y1], showgrid=False,
+                scaleanchor='x'
+            ),
+            images=[image],
+            annotations=[dict(
+                text=f"Density of all retweets, "
+                     f"{fraction:.0%} of them as markers",
+                xref='paper', yref='paper', x=1, y=1.02,
+                xanchor='right', showarrow=False,
+            )],
+            height=800,
         )
+    )
+
+    return fig
+
+
+@cached_figure
+def run_retweet_geograph(language, cluster=None, start=None, end=None,
+                         slots=None):
+    # Import retweet graph arrays (cached, read-only)
+    G = load_retweet_geonetwork(language)
 
     if not cluster:
-        cluster = {G.nodes[node]['cluster'] for node in G.nodes()}
+        cluster = G['cluster_names'].tolist()
     else:
         cluster = cluster.copy()
-    
-    # Filter G to nodes with only cluster values
-    G = filter_to_clusters(G, cluster)
 
-    # Build scatter tweets
-    edge_trace, node_trace = geo_scatters(G, cluster)
+    # Density image of large selections, see raster.py
+    if config.RASTER_THRESHOLD:
+        selection = select_clusters(G, cluster, start, end)
+        if selection_points(selection) > config.RASTER_THRESHOLD:
+            return build_georaster(G, selection, cluster, slots)
+
+    # Build scatter tweets of the cluster values
+    edge_trace, node_trace = geo_scatters(G, cluster, start, end, slots)
 
     # build total figure
     fig = build_geoplot(edge_trace, node_trace)
 
     return fig
+
+
+def run_retweet_geopatch(language, previous, cluster, start=None, end=None,
+                         slots=None):
+    """
+    Update of the geo graph of the clusters previous to those of cluster,
+    a dash.Patch removing and adding only the traces of the changed
+    clusters, see retweet_graph.run_retweet_patch. The whole figure when
+    it is rasterized or of all clusters.
+
+    Return: dict()
+    """
+
+    G = load_retweet_geonetwork(language)
+    previous, cluster = sorted(set(previous)), sorted(set(cluster))
+    selection = select_clusters(
+        G, sorted(set(previous) | set(cluster)), start, end
+    )
+    if (not previous or not cluster
+            or 0 < config.RASTER_THRESHOLD < selection_points(selection)):
+        return run_retweet_geograph(language, cluster, start, end, slots)
+
+    comps_bounds = component_bounds(cluster, slots)
+    patch = patch_clusters(previous, cluster, lambda c: cluster_geoscatter(
+        G, *selection[c], c, comps_bounds[c]['color']
+    ), groups=edge_groups() + 1)
+
+    return encoding.encode(patch)
@@ -1,164 +1,279 @@
 
+import functools
+
 import pandas as pd
 import numpy as np
-import networkx as nx
 import plotly.graph_objects as go
 
-from data import import_conflict_data
+import config
+import encoding
+from data import (
+    conflict_data, conflict_window, load_retweet_network, node_jitter,
+    stable_uniform
+)
+from figure_cache import cached_figure
+from figures import patch_clusters
+from graph_arrays import (
+    cluster_codes, edge_segments, select_clusters, selected_edges,
+    selected_nodes, selection_points, to_datetime64
+)
+from raster import layout_image, numeric, rasterize
+
+# Colors of the clusters, in the order of their traces
+COLORWAY = ['#5E0DAC', '#FF4F00', '#375CB1', '#FF7400', '#FFF400', '#FF0056']
+
+
+def filter_to_clusters(G, clusters, start=None, end=None):
+    """
+    Filters the nodes and edges of the graph arrays G on 'cluster' and
+    on a date window. G is not modified, positions into its arrays are
+    returned, see graph_arrays.select_clusters.
+
+    Return: dict(cluster -> (slice, np.ndarray))
+    """
 
-CONFLICT_DF = import_conflict_data('conflict_data_ukr.csv')
+    return select_clusters(G, clusters, start, end)
 
 
-def filter_to_clusters(G, clusters):
+def component_bounds(clusters, slots=None):
     """
-    Filters the nodes of G based on attribute 'cluster'
+    Create the bounds for axis of the plot, list of clusters. Every
+    cluster gets the band and color of its slot, by default its position
+    in clusters.
 
-    Return: nx.Graph()
+    Return: dict()
     """
 
-    remove_nodes_cluster = []
-    for node in G.nodes():
-        if G.nodes[node]['cluster'] not in set(clusters):
-            remove_nodes_cluster.append(node)
+    if not slots or any(c not in slots for c in clusters):
+        slots = {c: i for i, c in enumerate(clusters)}
 
-    for node in remove_nodes_cluster:
-        G.remove_node(node)
+    comps_bounds = {c: {
+        'low': slots[c] + 2,
+        'high': slots[c] + 2.8,
+        'label': c,
+        'color': COLORWAY[slots[c] % len(COLORWAY)],
+    } for c in clusters}
 
-    return G
+    return comps_bounds
 
 
-def component_bounds(clusters):
+def band_ticks(comps_bounds):
     """
-    Create the bounds for axis of the plot, list of clusters
+    Ticks of the y-axis, the conflicts and the middle of every band
 
-    Return: dict()
+    Return: list(float), list(str)
     """
 
-    comps_bounds = {c: {
-        'low': i,
-        'high': i+0.8,
-        'label': c
-    } for i, c in enumerate(clusters, start=2)}
+    tickvals = [.75] + [
+        np.mean([bounds['low'], bounds['high']])
+        for bounds in comps_bounds.values()
+    ]
+    ticktext = ['Conflict'] + [
+        label['label'][:30] for label in comps_bounds.values()
+    ]
 
-    return comps_bounds
+    return tickvals, ticktext
 
 
-def add_positions(G, comps_bounds):
+def add_positions(G, selection, comps_bounds):
     """
-    Add positions to graph based on component_bounds
+    Y positions of the nodes based on component_bounds, the x position
+    is the date. Kept outside of G, the arrays are shared between
+    callbacks. Nodes outside of the selection get NaN.
+
+    Return: np.ndarray
     """
 
-    for node in G.nodes():
-        G.nodes[node]['pos'] = [
-            G.nodes[node]['date'],
-            np.random.uniform(
-                low=comps_bounds[G.nodes[node]['cluster']]['low'],
-                high=comps_bounds[G.nodes[node]['cluster']]['high']
-            )
-        ]
+    # Bounds per cluster code
+    codes = cluster_codes(G, comps_bounds)
+    low = np.full(len(G['cluster_names']), np.nan)
+    high = np.full(len(G['cluster_names']), np.nan)
+    for code in codes:
+        bounds = comps_bounds[G['cluster_names'][code]]
+        low[code], high[code] = bounds['low'], bounds['high']
 
-    for edge in G.edges():
-        G.nodes[edge[0]]['pos'] = G.nodes[edge[0]]['pos']
-        G.nodes[edge[1]]['pos'] = G.nodes[edge[1]]['pos']
+    nodes = selected_nodes(selection)
+    node_codes = G['cluster'][nodes]
+    # Single precision is finer than a pixel, and halves the figure. The
+    # jitter is a hash of the node id, every figure of a node puts it
+    # at the same height.
+    pos_y = np.full(len(G['node_id']), np.nan, dtype=np.float32)
+    low, high = low[node_codes], high[node_codes]
+    pos_y[nodes] = low + node_jitter(G)[nodes] * (high - low)
 
-    return G
+    return pos_y
 
 
 def conflict_scatter(conflict_df):
     """
-    Set the scatter plot for conflict data
+    Set the scatter plot for conflict data. Only the columns of the
+    hovertemplate are sent along as customdata, and the jitter is
+    derived from the conflict id so every figure gets the same plot.
 
     Return: go.Scatter()
     """
 
     # Create nodes for conflict data
-    # add nodes
-    conf_node_x = []
-    conf_node_y = []
-    for idx in conflict_df.index:
-        x, y = conflict_df.loc[idx, 'date_start'], np.random.uniform(0, 1.5)
-        conf_node_x.append(x)
-        conf_node_y.append(y)
+    conf_node_x = conflict_df['date_start'].values
+    conf_node_y = stable_uniform(
+        conflict_df['id'].values, 0, 1.5
+    ).astype(np.float32)
+    deaths = conflict_df['deaths_civilians'].values
+
+    customdata = np.stack([
+        conflict_df['conflict_name'].values,
+        deaths,
+        conflict_df['date_start'].dt.strftime('%Y-%m-%d').values,
+    ], axis=-1)
 
     conf_node_trace = go.Scatter(
         x=conf_node_x, y=conf_node_y,
         name='Conflicts',
         mode='markers',
-        customdata=conflict_df,
-        hovertemplate='<i>Conflict name:</i> %{customdata[8]}<br><i>Deaths:</i> \
-                       %{customdata[41]}<br><i>Date:</i> %{customdata[37]}}',
-        marker=dict(size=10+(conflict_df['deaths_civilians']*5))
+        customdata=customdata,
+        hovertemplate='<i>Conflict name:</i> %{customdata[0]}<br>'
+                      '<i>Deaths:</i> %{customdata[1]}<br>'
+                      '<i>Date:</i> %{customdata[2]}',
+        marker=dict(size=10 + deaths * 5)
     )
 
     return conf_node_trace
 
 
-def retweet_scatter(G, clusters):
+def downsample(G, selection, max_points):
     """
-    Set the scatter plot for retweets with nodes and edges
+    The selection when its nodes and edges fit in max_points, else a
+    sample of it. Nodes are kept on a stable hash of their position in
+    the arrays, so zooming in keeps the nodes already drawn, and edges
+    with their source node. Nodes of a sampled cluster are an array of
+    positions.
+
+    Return: dict(cluster -> (slice or np.ndarray, np.ndarray)), float
+    """
+
+    points = selection_points(selection)
+    if points <= max_points:
+        return selection, 1.0
+
+    fraction = max_points / points
+    sample = {}
+    for c, (nodes, edges) in selection.items():
+        positions = np.arange(nodes.start, nodes.stop)
+        kept = stable_uniform(positions, 0, 1) < fraction
+        edges = edges[kept[G['src'][edges] - nodes.start]]
+        sample[c] = (np.flatnonzero(kept) + nodes.start, edges)
+
+    return sample, fraction
+
+
+def retweet_scatter(G, selection, pos_y, comps_bounds):
+    """
+    Set the scatter plot for retweets, an edge and a node trace for
+    every cluster of the selection in its order. Empty clusters get
+    empty traces, so the traces of a cluster are at known positions for
+    run_retweet_patch. Drawn with WebGL above config.WEBGL_THRESHOLD
+    points.
+
+    Return: list(go.Scatter()), list(go.Scatter())
+    """
+
+    points = selection_points(selection)
+    # WebGL traces are not drawn in the range slider, SVG ones stall the
+    # browser with many points
+    scatter = go.Scattergl if points > config.WEBGL_THRESHOLD else go.Scatter
+
+    edge_trace = []
+    node_trace = []
+    # the nodes of a cluster are one slice of the arrays, or the
+    # positions of a sample
+    for c, (nodes, edges) in selection.items():
+        edge, node = cluster_scatter(
+            G, nodes, edges, pos_y, c, comps_bounds[c]['color'], scatter
+        )
+        edge_trace.append(edge)
+        node_trace.append(node)
+
+    return edge_trace, node_trace
+
+
+def cluster_scatter(G, nodes, edges, pos_y, name, color, scatter=go.Scatter):
+    """
+    The edge and the node trace of one cluster, its edges are toggled
+    with its nodes in the legend
 
     Return: go.Scatter(), go.Scatter()
     """
-    edge_x = []
-    edge_y = []
-    for edge in G.edges():
-        x0, y0 = G.nodes[edge[0]]['pos']
-        x1, y1 = G.nodes[edge[1]]['pos']
-        edge_x.append(x0)
-        edge_x.append(x1)
-        edge_x.append(None)
-        edge_y.append(y0)
-        edge_y.append(y1)
-        edge_y.append(None)
-
-    edge_trace = go.Scatter(
-        x=edge_x, y=edge_y,
+
+    src, dst = G['src'][edges], G['dst'][edges]
+    edge_trace = scatter(
+        x=edge_segments(G['date'], src, dst, np.datetime64('NaT')),
+        y=edge_segments(pos_y, src, dst, np.nan),
         line=dict(width=0.5, color='#eeeeee'),
         name='Edges',
+        legendgroup=name,
+        showlegend=False,
         hoverinfo='none',
         mode='lines')
 
-    # add nodes
-    node_x = {c: [] for c in clusters}
-    node_y = {c: [] for c in clusters}
+    node_trace = scatter(
+        x=G['date'][nodes], y=pos_y[nodes],
+        name=name,
+        legendgroup=name,
+        mode='markers',
+        marker=dict(color=color),
+        hoverinfo='skip',
+        hovertemplate='<i>Account:</i> No info yet',
+    )
+
+    return edge_trace, node_trace
 
-    for node in G.nodes():
-        c = G.nodes[node]['cluster']
-        x, y = G.nodes[node]['pos']
-        node_x[c].append(x)
-        node_y[c].append(y)
 
-    # find cluster without nodes
-    empty_clusters = [name for name, c in node_x.items() if c == []]
-    # remove empty clusters
-    for c in empty_clusters:
-        node_x.pop(c), node_y.pop(c), clusters.remove(c)
+def raster_layer(G, selection, x, y, colors, extent):
+    """
+    Density image of all nodes and edges of the selection, at x and y
+    (arrays over all nodes, x can be dates), colored per cluster (colors
+    of the keys of the selection), as a layout image over extent (x0,
+    x1, y0, y1), see raster.py
 
-    node_trace = []
-    for c in clusters:
-        node_trace.append(go.Scatter(
-            x=node_x[c], y=node_y[c],
-            name=c,
-            mode='markers',
-            hoverinfo='skip',
-            hovertemplate='<i>Account:</i> No info yet',
-        ))
+    Return: dict()
+    """
 
-    return edge_trace, node_trace
+    nodes = selected_nodes(selection)
+    edges = selected_edges(selection)
+    sizes = [len(range(s.start, s.stop)) for s, _ in selection.values()]
+
+    # Positions in the selected nodes
+    compact = np.full(len(G['node_id']), -1, dtype=np.int64)
+    compact[nodes] = np.arange(len(nodes))
+
+    x0, x1, y0, y1 = extent
+    image = rasterize(
+        numeric(x[nodes]), y[nodes],
+        np.repeat(np.arange(len(sizes)), sizes),
+        compact[G['src'][edges]], compact[G['dst'][edges]],
+        (numeric(x0), numeric(x1), y0, y1),
+        (config.RASTER_WIDTH, config.RASTER_HEIGHT),
+        [colors[c] for c in selection]
+    )
+
+    return layout_image(image, extent)
 
 
-def build_plot(edge_trace, node_trace, conf_node_trace, comps_bounds):
+def build_plot(edge_trace, node_trace, conf_node_trace, comps_bounds,
+               start=None, end=None, view=None):
     """
-    Build the plot.
+    Build the plot, the x-axis shows the dates start to end, or the
+    visible part view (start, end) of them with the range slider still
+    spanning start to end.
 
     Return: fig
     """
+    tickvals, ticktext = band_ticks(comps_bounds)
     fig = go.Figure(
-        data=[edge_trace] + node_trace + [conf_node_trace],
+        data=edge_trace + node_trace + [conf_node_trace],
         layout=go.Layout(
             height=800,
-            colorway=['#5E0DAC', '#FF4F00', '#375CB1',
-                      '#FF7400', '#FFF400', '#FF0056'],
+            colorway=COLORWAY,
             template='plotly_dark',
             paper_bgcolor='rgba(0, 0, 0, 0)',
             plot_bgcolor='rgba(0, 0, 0, 0)',
@@ -181,11 +296,11 @@ def build_plot(edge_trace, node_trace, conf_node_trace, comps_bounds):
                 gridwidth=0.5,
                 zeroline=False,
                 # color='#FFFFFF',
-                range=[
-                    pd.to_datetime("01-01-2016"),
-                    pd.to_datetime("06-06-2017")
-                ],
-                rangeslider_visible=True,
+                range=date_range(*view) if view else date_range(start, end),
+                rangeslider=dict(
+                    visible=True,
+                    range=date_range(start, end) if view else None
+                ),
                 type="date"
             ),
             yaxis=dict(
@@ -195,13 +310,8 @@ def build_plot(edge_trace, node_trace, conf_node_trace, comps_bounds):
                 zeroline=False,
                 color='#FFFFFF',
                 tickmode='array',
-                tickvals=[.75] + [np.mean([
-                    bounds['low'],
-                    bounds['high']
-                ]) for bounds in comps_bounds.values()],
-                ticktext=['Conflict'] + [
-                    label['label'][:30] for label in comps_bounds.values()
-                ]
+                tickvals=tickvals,
+                ticktext=ticktext
             )
         )
     )
@@ -209,54 +319,237 @@ def build_plot(edge_trace, node_trace, conf_node_trace, comps_bounds):
     return fig
 
 
-def run_retweet_graph(language, cluster=None, cluster_update=False):
-    # Import retweet graph
-    if language == 'all':
-        # Import all retweets
-        G = nx.read_gpickle('new_graphs/retweet_network.pickle')
-    elif language == 'english':
-        # Import only tweets with english articles
-        G = nx.read_gpickle(
-            'new_graphs/retweet_network_english.pickle'
-        )
-    elif language == 'russian':
-        # Import only tweets with russian articles
-        G = nx.read_gpickle(
-            'new_graphs/retweet_network_russian.pickle'
-        )
+def date_extent(G, selection, start=None, end=None):
+    """
+    First and last moment of the window [start, end], the first and
+    last date of the selected nodes when open
+
+    Return: tuple(np.datetime64, np.datetime64)
+    """
+
+    dates = G['date'][selected_nodes(selection)]
+    first = to_datetime64(start) if start else dates.min()
+    last = (to_datetime64(end) + np.timedelta64(1, 'D') if end
+            else dates.max())
+
+    return first, last
+
+
+def date_range(start=None, end=None):
+    """
+    Range of a date axis, None for the whole axis
+
+    Return: list() or None
+    """
+
+    if not start and not end:
+        return None
+    return [
+        pd.to_datetime(start) if start else None,
+        pd.to_datetime(end) if end else None
+    ]
+
+
+@functools.lru_cache(maxsize=32)
+def conflict_trace(start=None, end=None):
+    """
+    Set the scatter plot for the conflicts within [start, end], built
+    once per window and reused by every figure (go.Figure copies its
+    traces). The window is a binary search on the sorted conflict data.
+
+    Return: go.Scatter()
+    """
+
+    return conflict_scatter(conflict_window(conflict_data(), start, end))
+
+
+def retweet_arrays(language, start=None, end=None):
+    """
+    Compact arrays of the retweet network of a language within the
+    window [start, end], shipped once to the browser where
+    assets/clientside.js filters the clusters and builds the histogram.
+    Dates are in ms since epoch, jitter is the relative y position of a
+    node within its cluster band, and figure is the plot without tweets
+    (edge trace style, conflicts, layout). Clusters get the colors of
+    colorway by slot, like component_bounds. Arrays are typed arrays,
+    see encoding.py.
+
+    Return: dict()
+    """
+
+    G = load_retweet_network(language)
+    clusters = G['cluster_names'].tolist()
+    selection = filter_to_clusters(G, clusters, start, end)
+    nodes = selected_nodes(selection)
+    edges = selected_edges(selection)
+
+    # Positions in the compact arrays
+    compact = np.full(len(G['node_id']), -1, dtype=np.int64)
+    compact[nodes] = np.arange(len(nodes))
+    node_counts = [s.stop - s.start for s, _ in selection.values()]
+    edge_counts = [len(e) for _, e in selection.values()]
+
+    edge_trace, _ = cluster_scatter(
+        G, slice(0, 0), slice(0, 0), np.empty(0), 'Edges', COLORWAY[0]
+    )
+    fig = build_plot(
+        [edge_trace], [], conflict_trace(start, end), {}, start, end
+    )
+
+    return encoding.encode({
+        'clusters': clusters,
+        'node_offsets': [0] + np.cumsum(node_counts).tolist(),
+        'edge_offsets': [0] + np.cumsum(edge_counts).tolist(),
+        'date': G['date'][nodes],
+        'jitter': node_jitter(G)[nodes].astype(np.float32),
+        'src': compact[G['src'][edges]].astype(np.int32),
+        'dst': compact[G['dst'][edges]].astype(np.int32),
+        'figure': fig,
+        'colorway': COLORWAY,
+        'webgl_threshold': config.WEBGL_THRESHOLD,
+    })
+
+
+@cached_figure
+def run_retweet_graph(language, cluster=None, start=None, end=None,
+                      cluster_update=False, view_start=None, view_end=None,
+                      slots=None):
+    # Import retweet graph arrays (cached, read-only)
+    G = load_retweet_network(language)
 
     if not cluster:
-        cluster = sorted(list({
-            G.nodes[node]['cluster'] for node in G.nodes()
-        }))
+        cluster = G['cluster_names'].tolist()
         if cluster_update:
             return [{'label': f'{c}', 'value': f'{c}'} for c in cluster]
     else:
         cluster = cluster.copy()
-    # Filter G to nodes with only cluster values
-    G = filter_to_clusters(G, cluster)
+    # Filter G to nodes with only cluster values, within the visible
+    # part of the window when zoomed in
+    view = (view_start, view_end) if view_start or view_end else None
+    selection = filter_to_clusters(
+        G, cluster, *(view or (start, end))
+    )
 
-    # Create boundries for plot, and add to graph
-    comps_bounds = component_bounds(cluster)
-    G = add_positions(G, comps_bounds)
+    # Create boundries for plot, and positions of the nodes
+    comps_bounds = component_bounds(cluster, slots)
+    pos_y = add_positions(G, selection, comps_bounds)
 
     # Build scatter conflict
-    conflict_df = CONFLICT_DF.copy()
+    conf_node_trace = conflict_trace(start, end)
+
+    # Build scatter tweets, sampled when there are too many to draw, or
+    # a density image of all of them with a sample of the nodes on top
+    raster = 0 < config.RASTER_THRESHOLD < selection_points(selection)
+    if raster:
+        image = raster_layer(
+            G, selection, G['date'], pos_y,
+            {c: b['color'] for c, b in comps_bounds.items()},
+            date_extent(G, selection, *(view or (start, end))) + (
+                min(b['low'] for b in comps_bounds.values()),
+                max(b['high'] for b in comps_bounds.values())
+            )
+        )
+        selection = {c: (n, e[:0]) for c, (n, e) in selection.items()}
+        max_points = config.RASTER_OVERLAY_POINTS
+    else:
+        max_points = config.LOD_MAX_POINTS
+    drawn, fraction = downsample(G, selection, max_points)
+    edge_trace, node_trace = retweet_scatter(G, drawn, pos_y, comps_bounds)
 
-    # Filter to only usable data
-    conflict_df = conflict_df[
-        conflict_df['date_start'] > pd.to_datetime("1-1-2016")
-    ]
-    conflict_df = conflict_df[
-        conflict_df['date_start'] < pd.to_datetime("1-6-2017")
-    ]
+    # build total figure
+    fig = build_plot(
+        edge_trace, node_trace, conf_node_trace, comps_bounds, start, end,
+        view
+    )
+    if raster:
+        fig.add_layout_image(image)
+        note = f"Density of all retweets, {fraction:.0%} of them as markers"
+    else:
+        note = f"{fraction:.0%} of the retweets shown, zoom in for all"
+    if raster or fraction < 1:
+        fig.add_annotation(
+            text=note,
+            xref='paper', yref='paper', x=1, y=1.02,
+            xanchor='right', showarrow=False,
+            font=dict(color='#FFFFFF')
+        )
 
-    conf_node_trace = conflict_scatter(conflict_df)
+    return fig
 
-    # Build scatter tweets
-    edge_trace, node_trace = retweet_scatter(G, cluster)
 
-    # build total figure
-    fig = build_plot(edge_trace, node_trace, conf_node_trace, comps_bounds)
+def window_sampled(language, cluster, start=None, end=None):
+    """
+    Whether the histogram of the window is sampled or rasterized, only
+    then does zooming in show more of it (see run_retweet_detail)
 
-    return fig
+    Return: bool
+    """
+
+    G = load_retweet_network(language)
+    points = selection_points(filter_to_clusters(
+        G, cluster or G['cluster_names'].tolist(), start, end
+    ))
+    return (points > config.LOD_MAX_POINTS
+            or 0 < config.RASTER_THRESHOLD < points)
+
+
+def run_retweet_detail(language, cluster, start, end, view_start, view_end,
+                       slots=None):
+    """
+    The histogram of the window zoomed in to [view_start, view_end], see
+    run_retweet_graph. Not cached, every zoom is another view: they
+    would evict the figures of whole windows from the figure cache.
+
+    Return: dict()
+    """
+
+    return encoding.encode(run_retweet_graph.__wrapped__(
+        language, sorted(set(cluster)), start, end,
+        view_start=view_start, view_end=view_end, slots=slots
+    ))
+
+
+def run_retweet_patch(language, previous, cluster, start=None, end=None,
+                      slots=None):
+    """
+    Update of the histogram of the clusters previous to those of cluster
+    (same language and window), a dash.Patch removing the traces of the
+    deselected clusters and adding those of the new ones, and setting
+    the ticks. The whole figure when the traces do not map one to one to
+    the clusters: sampled, rasterized or all clusters, or when the trace
+    type changes, the figure crossing config.WEBGL_THRESHOLD.
+
+    Return: dict()
+    """
+
+    G = load_retweet_network(language)
+    previous, cluster = sorted(set(previous)), sorted(set(cluster))
+    selection = filter_to_clusters(
+        G, sorted(set(previous) | set(cluster)), start, end
+    )
+    points = selection_points(selection)
+    webgl = [
+        selection_points({c: selection[c] for c in clusters})
+        > config.WEBGL_THRESHOLD
+        for clusters in (previous, cluster)
+    ]
+    if (not previous or not cluster or points > config.LOD_MAX_POINTS
+            or 0 < config.RASTER_THRESHOLD < points
+            or webgl[0] != webgl[1]):
+        return run_retweet_graph(
+            language, cluster, start, end, slots=slots
+        )
+
+    comps_bounds = component_bounds(cluster, slots)
+    added = {c: selection[c] for c in cluster if c not in previous}
+    pos_y = add_positions(G, added, comps_bounds)
+    scatter = go.Scattergl if webgl[1] else go.Scatter
+
+    patch = patch_clusters(previous, cluster, lambda c: cluster_scatter(
+        G, *added[c], pos_y, c, comps_bounds[c]['color'], scatter
+    ))
+    tickvals, ticktext = band_ticks(comps_bounds)
+    patch['layout']['yaxis']['tickvals'] = tickvals
+    patch['layout']['yaxis']['ticktext'] = ticktext
+
+    return encoding.encode(patch)
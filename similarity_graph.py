@@ -1,8 +1,20 @@
+import hashlib
+import os
+import pickle
+import uuid
+
 import networkx as nx
-# import pandas as pd
-# import numpy as np
+import numpy as np
+import pandas as pd
 import plotly.graph_objs as go
-import pickle
+
+import config
+
+# Fruchterman-Reingold layout, derived from similarity_network.pickle
+# and stored with the figure cache: a file in data/ would change the
+# data version of every cached figure (see figure_cache.data_version)
+LAYOUT_PATH = os.path.join(config.FIGURE_CACHE_DIR, 'similarity_layout.pickle')
+LAYOUT_SEED = 42
 
 
 def remove_singles(G):
@@ -40,13 +52,15 @@ def edge_width(graph):
     return edge_width
 
 
-def node_color(graph, df):
-#assign node color based on the score
-    node_color = []
-    for i in graph.nodes():
-        index = df[df['Publication (original)'] == i].index[0]
-        node_color.append(df['score'][index])
-    return node_color
+def node_metadata(graph, df):
+#join the rows of df to the nodes on 'Publication (original)', one keyed lookup instead of a scan per node
+    indexed = df.drop_duplicates('Publication (original)').set_index('Publication (original)')
+    return indexed.reindex(list(graph.nodes()))
+
+
+def node_color(graph, meta):
+#assign node color based on the score, meta are the rows of node_metadata
+    return meta['score'].tolist()
 
 
 def draw_networkx_graph(graph):
@@ -57,10 +71,71 @@ def draw_networkx_graph(graph):
     plt.show()
 
 
-def get_coordinates(G):
+def graph_hash(G):
+    """Returns a hash of the nodes and edges of G, the key of a stored layout"""
+    h = hashlib.sha1()
+    for node in sorted(G.nodes()):
+        h.update(f"n{node}\n".encode())
+    for edge in sorted(G.edges()):
+        h.update(f"e{edge[0]}\t{edge[1]}\n".encode())
+    return h.hexdigest()
+
+
+def load_layout(G, path=LAYOUT_PATH, recompute=False, seed=LAYOUT_SEED):
+    """
+    Returns the Fruchterman-Reingold layout of G, stored in path and keyed
+    by the hash of G. The layout is only computed when G changed or
+    recompute is set, seeded and warm started from the stored positions
+    of the nodes that are still in G, so the graph does not jump around.
+    """
+    key = graph_hash(G)
+    stored = None
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            stored = pickle.load(f)
+
+    if stored is not None and stored['hash'] == key and not recompute:
+        return stored['pos']
+
+    init = None
+    if stored is not None:
+        init = {n: p for n, p in stored['pos'].items() if n in G}
+    pos = nx.fruchterman_reingold_layout(G, pos=init or None, seed=seed)
+    pos = {n: (float(p[0]), float(p[1])) for n, p in pos.items()}
+
+    # Write to a temporary file first, other workers may be reading it
+    # or writing it too
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(tmp, 'wb') as f:
+            pickle.dump({'hash': key, 'pos': pos}, f)
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+    return pos
+
+
+def filter_to_window(G, start=None, end=None):
+    """Returns the subgraph of the articles published within [start, end] (inclusive), articles without a date are kept"""
+    dates = pd.to_datetime([d for _, d in G.nodes(data='date')], format='%d/%m/%Y', errors='coerce')
+    keep = np.ones(len(dates), dtype=bool)
+    if start:
+        keep &= dates.isna() | (dates >= pd.to_datetime(start))
+    if end:
+        keep &= dates.isna() | (dates <= pd.to_datetime(end))
+    return G.subgraph([n for n, k in zip(G.nodes(), keep) if k])
+
+
+def get_coordinates(G, pos=None):
     """Returns the positions of nodes and edges in a format for Plotly to draw the network"""
-    # get list of node positions
-    pos = nx.fruchterman_reingold_layout(G)
+    # get list of node positions, computed once and stored
+    if pos is None:
+        pos = load_layout(G)
 
     Xnodes = [pos[n][0] for n in G.nodes()]
     Ynodes = [pos[n][1] for n in G.nodes()]
@@ -73,34 +148,22 @@ def get_coordinates(G):
         Yedges.extend([pos[e[0]][1], pos[e[1]][1], None])
     return Xnodes, Ynodes, Xedges, Yedges
 
-def descriptions(dataframe, G):
-    title_list = list()
-    date_list = list()
-    language = list()
-    keywords = list()
-    similarity = list()
-    cluster_name = list()
-    for i in G.nodes:
-        index = dataframe[dataframe['Publication (original)'] == i].index[0]
-        title_list.append(dataframe['Title'][index])
-        date_list.append(G.nodes[i]['date'])
-        language.append(dataframe['Language'][index])
-        keywords.append(dataframe['Keywords'][index])
-        similarity.append(dataframe['score'][index])
-        cluster_name.append(G.nodes[i]['cluster'])
-    title_dsp = ['Title: ' + r for r in title_list]
-    date_dsp = ['Date of publication: ' + r for r in date_list]
-    language_dsp = ['Language of article: ' + r for r in language]
-    keywords_dsp = ['Keywords of article: ' + r for r in keywords]
-    similarity_dsp = ['Similarity score with connection: ' + str(r) for r in similarity]
-    cluster_name_dsp = ['Cluster: ' + r for r in cluster_name]
+def descriptions(meta, G):
+    """Hover texts of the nodes, meta are the rows of node_metadata in the order of G.nodes"""
+    title_dsp = ('Title: ' + meta['Title'].astype(str)).tolist()
+    date_dsp = ['Date of publication: ' + r for _, r in G.nodes(data='date')]
+    language_dsp = ('Language of article: ' + meta['Language'].astype(str)).tolist()
+    keywords_dsp = ('Keywords of article: ' + meta['Keywords'].astype(str)).tolist()
+    similarity_dsp = ('Similarity score with connection: ' + meta['score'].astype(str)).tolist()
+    cluster_name_dsp = ['Cluster: ' + r for _, r in G.nodes(data='cluster')]
     return title_dsp, date_dsp, language_dsp, keywords_dsp, similarity_dsp, cluster_name_dsp
 
 
-def build_graph(G, df):
+def build_graph(G, df, pos=None):
 
-    Xnodes, Ynodes, Xedges, Yedges = get_coordinates(G)
-    title_dsp, date_dsp, language_dsp, keywords_dsp, similarity, cluster_name = descriptions(df, G)
+    Xnodes, Ynodes, Xedges, Yedges = get_coordinates(G, pos)
+    meta = node_metadata(G, df)
+    title_dsp, date_dsp, language_dsp, keywords_dsp, similarity, cluster_name = descriptions(meta, G)
     #create tooltip string by concatenating statistics
     description = [
         f"<b>{node}</b>" +
@@ -141,7 +204,7 @@ def build_graph(G, df):
         hovertext=description,
         showlegend=False)
 
-    tracer_marker.marker.color = node_color(G, df)
+    tracer_marker.marker.color = node_color(G, meta)
 
     axis_style = dict(
         title='',
@@ -193,7 +256,7 @@ def build_graph(G, df):
     return fig
 
 
-def run_similarity_graph():
+def run_similarity_graph(start=None, end=None):
 
     # Import dataframe similarity analyses
     with open('data/similarity_df.pickle', 'rb') as f:
@@ -206,7 +269,22 @@ def run_similarity_graph():
     # Remove single node clusters
     G = remove_singles(G)
 
+    # Layout of the whole graph, the window does not move the nodes
+    pos = load_layout(G)
+    if start or end:
+        G = filter_to_window(G, start, end)
+
     # Build the graph 
-    fig = build_graph(G, df)
+    fig = build_graph(G, df, pos)
+
+    return fig
 
-    return fig
\ No newline at end of file
+
+if __name__ == '__main__':
+    # Compute the layout offline, recompute to start from a new seed
+    import sys
+
+    with open('data/similarity_network.pickle', 'rb') as f:
+        G = remove_singles(pickle.load(f)[0])
+    load_layout(G, recompute='--recompute' in sys.argv)
+    print(f"Stored layout of {G.number_of_nodes()} nodes in {LAYOUT_PATH}")
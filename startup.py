@@ -0,0 +1,122 @@
+"""
+Startup of the dashboard, timed per phase.
+
+Importing app.py only imports Dash and builds the layout. The figure
+modules, with pandas, networkx and the data they read, are imported on
+the first call of one of their functions (see lazy), or all at once by
+preload when PRELOAD is set. The time of every phase, and from the
+start of the import to the first response, is logged as a report.
+"""
+
+import contextlib
+import importlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+START = time.perf_counter()
+
+# name -> seconds, in the order the phases ran
+PHASES = {}
+
+_LAST_MARK = START
+
+_IMPORT_LOCK = threading.Lock()
+
+
+@contextlib.contextmanager
+def phase(name):
+    """
+    Times the block as the phase name
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        PHASES[name] = time.perf_counter() - start
+
+
+def mark(name):
+    """
+    Records the time since the previous mark, or the start, as the phase
+    name. Used for the consecutive phases of importing app.py.
+    """
+
+    global _LAST_MARK
+    now = time.perf_counter()
+    PHASES[name] = now - _LAST_MARK
+    _LAST_MARK = now
+
+
+class lazy:
+    """
+    A function of a module, the module is imported on the first call.
+    Can be pickled, like the function itself, for the process pool.
+    """
+
+    def __init__(self, module, name):
+        self.module = module
+        self.name = name
+        self.__name__ = name
+
+    def __call__(self, *args, **kwargs):
+        return self.function()(*args, **kwargs)
+
+    def function(self):
+        # Imports from several threads of the figure pool at once would
+        # see half initialized modules
+        with _IMPORT_LOCK:
+            if self.module not in PHASES:
+                with phase(self.module):
+                    module = importlib.import_module(self.module)
+            else:
+                module = importlib.import_module(self.module)
+        return getattr(module, self.name)
+
+
+def preload(modules, loaders=()):
+    """
+    Imports the modules and calls the loaders (lazy functions) now,
+    instead of on the first request, each as a phase
+    """
+
+    for module in modules:
+        lazy(module, '__name__').function()
+    for loader in loaders:
+        with phase(f"{loader.module}.{loader.name}()"):
+            loader()
+
+
+def report():
+    """
+    Logs the time of every phase so far, and since the start
+
+    Return: str
+    """
+
+    lines = [f"{seconds:8.3f}s {name}" for name, seconds in PHASES.items()]
+    lines.append(f"{time.perf_counter() - START:8.3f}s since start")
+    text = "\n".join(lines)
+    logger.info("startup:\n%s", text)
+
+    return text
+
+
+def report_first_response(server):
+    """
+    Adds the time from the start to the first response of the Flask
+    server to the phases, and logs the report
+    """
+
+    def first_response(response):
+        if 'first response since start' not in PHASES:
+            PHASES['first response since start'] = (
+                time.perf_counter() - START
+            )
+            report()
+        return response
+
+    server.after_request(first_response)
@@ -0,0 +1,39 @@
+"""
+Tests of generate_data.py on networks without edges or nodes
+"""
+
+import os
+
+import numpy as np
+
+import generate_data
+from graph_arrays import read_arrays
+
+
+def generate(directory, **options):
+    arguments = dict(
+        nodes=300, edges=1000, n_clusters=4, start='2016-01-01',
+        end='2016-12-31', n_articles=20, n_conflicts=10
+    )
+    arguments.update(options)
+    generate_data.generate(str(directory), **arguments)
+    return os.path.join(str(directory), 'new_graphs')
+
+
+def test_no_edges(tmp_path):
+    graphs = generate(tmp_path, edges=0)
+
+    arrays = read_arrays(os.path.join(graphs, 'retweet_network.pickle'))
+    assert len(arrays['node_id']) == 300
+    assert len(arrays['src']) == 0
+    assert np.all(arrays['edge_offsets'] == 0)
+
+
+def test_no_geo_share(tmp_path):
+    graphs = generate(tmp_path, geo_share=0)
+
+    arrays = read_arrays(os.path.join(graphs, 'retweet_geonetwork.pickle'))
+    assert len(arrays['node_id']) == 0
+    assert len(arrays['src']) == 0
+    arrays = read_arrays(os.path.join(graphs, 'retweet_network.pickle'))
+    assert len(arrays['node_id']) == 300